@@ -1,3 +1,24 @@
-from morfist.core.MixedRandomForest import MixedRandomForest
-from morfist.algo.evaluation import cross_validation
-from morfist.legacy.core import MixedRandomForestLegacy
+import importlib
+
+# The public objects are imported the first time they are used,
+# so that importing morfist does not load numba, scipy or the legacy implementation
+_exports = {
+    'MixedRandomForest': 'morfist.core.MixedRandomForest',
+    'cross_validation': 'morfist.algo.evaluation',
+    'MixedRandomForestLegacy': 'morfist.legacy.core',
+    'warmup': 'morfist.core.warmup',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,59 @@
+import numpy as np
+
+MAX_BINS = 255
+# Bin of the missing values, after the last bin of the values
+MISSING_BIN = 255
+
+
+def floor_to_dtype(values, dtype):
+    """Round split values down to the given floating point type
+
+    The result is the largest value of dtype that is not greater than each value, so for data of that
+    type the comparison x <= threshold gives the same result before and after the rounding.
+
+    :param values: split values
+    :param dtype: floating point type of the data
+    :return: the values rounded down to dtype
+    """
+    dtype = np.dtype(dtype)
+    values = np.asarray(values, dtype=np.float64)
+    rounded = values.astype(dtype)
+    return np.where(rounded > values, np.nextafter(rounded, dtype.type(-np.inf)), rounded).astype(dtype)
+
+
+def get_bin_thresholds(x, max_bins=MAX_BINS):
+    """Find the bin boundaries used to quantize every feature
+
+    :param x: training data
+    :param max_bins: maximum number of bins per feature, at most 255 so that bins fit in an uint8
+    :return: list with the sorted thresholds of each feature, a value v falls in bin b if
+             thresholds[b - 1] < v <= thresholds[b]. Thresholds have the floating point type of x
+    """
+    max_bins = min(max_bins, MAX_BINS)
+    dtype = np.result_type(x.dtype, np.float32)
+    thresholds = []
+    for feature in range(x.shape[1]):
+        values = np.unique(x[:, feature]).astype(np.float64)
+        values = values[~np.isnan(values)]
+        if values.size <= max_bins:
+            # Every distinct value gets its own bin, boundaries are the midpoints as in the exact splitter
+            thresholds.append(floor_to_dtype((values[:-1] + values[1:]) / 2, dtype))
+        else:
+            # Boundaries at the quantiles of the feature so that bins hold a similar amount of samples
+            quantiles = np.nanpercentile(x[:, feature], np.linspace(0, 100, max_bins + 1)[1:-1])
+            thresholds.append(np.unique(floor_to_dtype(quantiles, dtype)))
+    return thresholds
+
+
+def bin_data(x, thresholds):
+    """Quantize the data into the bins given by get_bin_thresholds
+
+    :param x: data to quantize
+    :param thresholds: bin boundaries of every feature
+    :return: uint8 matrix with the bin of every value, MISSING_BIN for missing values
+    """
+    x_binned = np.zeros(x.shape, dtype=np.uint8)
+    for feature, feature_thresholds in enumerate(thresholds):
+        x_binned[:, feature] = np.searchsorted(feature_thresholds, x[:, feature], side='left')
+        x_binned[np.isnan(x[:, feature]), feature] = MISSING_BIN
+    return x_binned
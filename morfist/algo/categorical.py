@@ -0,0 +1,46 @@
+import numpy as np
+from numba import njit
+
+# Number of categories stored in every word of a bitset
+WORD_SIZE = 64
+
+
+@njit(cache=True)
+def bitset_contains(bitset, value):
+    # Whether the category of a value is in the bitset, categories outside of it are not
+    if not 0 <= value < WORD_SIZE * bitset.size:
+        return False
+    c = int(value)
+    return (bitset[c // WORD_SIZE] >> np.uint64(c % WORD_SIZE)) & np.uint64(1) == 1
+
+
+@njit(cache=True)
+def in_bitset(values, bitset):
+    # Whether the category of every value is in the bitset
+    mask = np.zeros(values.size, dtype=np.bool_)
+    for i in range(values.size):
+        mask[i] = bitset_contains(bitset, values[i])
+    return mask
+
+
+def append_bitset(table, bitset):
+    """Add a bitset to a table of bitsets, padding them to the same number of words
+
+    :param table: matrix with a bitset in every row
+    :param bitset: bitset to add
+    :return: the new table, the bitset is its last row
+    """
+    n_words = max(table.shape[1], bitset.size)
+    table = np.pad(table, ((0, 0), (0, n_words - table.shape[1])))
+    bitset = np.pad(bitset, (0, n_words - bitset.size))
+    return np.vstack((table, bitset)).astype(np.uint64)
+
+
+def bitset_categories(bitset):
+    """Categories of a bitset
+
+    :param bitset: bitset of categories
+    :return: sorted array with the categories in the bitset
+    """
+    bits = np.unpackbits(bitset.astype('<u8').view(np.uint8), bitorder='little')
+    return np.flatnonzero(bits)
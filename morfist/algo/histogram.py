@@ -2,7 +2,7 @@ import numpy as np
 from numba import njit
 
 
-@njit
+@njit(cache=True)
 def get_bin_edges(a, bins):
     bin_edges = np.zeros((bins + 1,), dtype=np.float64)
     a_min = a.min()
@@ -15,7 +15,7 @@ def get_bin_edges(a, bins):
     return bin_edges
 
 
-@njit
+@njit(cache=True)
 def compute_bin(x, bin_edges):
     # assuming uniform bins for now
     n = bin_edges.shape[0] - 1
@@ -34,7 +34,7 @@ def compute_bin(x, bin_edges):
         return bin
 
 
-@njit
+@njit(cache=True)
 def numba_histogram(a, bins):
     hist = np.zeros((bins,), dtype=np.intp)
     bin_edges = get_bin_edges(a, bins)
@@ -0,0 +1,145 @@
+import numpy as np
+from numba import njit
+
+from morfist.algo.histogram import get_bin_edges
+
+# Value added to every impurity so that pure nodes do not give a division by zero
+DELTA = 0.0001
+# Number of bins of the histograms used to estimate the impurity of regression targets
+N_BINS_REGRESSION = 100
+
+
+@njit(cache=True)
+def impurity_classification_counts(counts, n):
+    # Calculate the impurity value for the classification task from the class counts
+    result = 0.0
+    for i in range(counts.size):
+        if counts[i]:
+            frequency = counts[i] / n
+            result += frequency * np.log2(frequency)
+
+    return 0 - result
+
+
+@njit(cache=True)
+def impurity_regression_counts(counts, n, bin_width):
+    # Calculate the impurity value for the regression task from the counts of fixed width bins
+    occupied = 0
+    for i in range(counts.size):
+        if counts[i]:
+            occupied += 1
+    if occupied < 2 or bin_width == 0:
+        return 0.0
+
+    n_bins = counts.size
+    frequency = (counts / n) / bin_width
+    probability = (frequency + 1) / (frequency.sum() + n_bins)
+
+    return 0 - bin_width * (probability * np.log2(probability)).sum()
+
+
+@njit(cache=True)
+def impurity_counts(counts, n, code_offsets, bin_widths, is_classification):
+    # Impurity of every target of a node, given the concatenated code counts of all the targets
+    n_targets = bin_widths.size
+    impurity = np.zeros(n_targets)
+    for t in range(n_targets):
+        target_counts = counts[code_offsets[t]:code_offsets[t + 1]]
+        if is_classification[t]:
+            impurity[t] = impurity_classification_counts(target_counts, n) + DELTA
+        else:
+            impurity[t] = impurity_regression_counts(target_counts, n, bin_widths[t]) + DELTA
+    return impurity
+
+
+@njit(cache=True)
+def node_counts(codes, weights, idx, code_offsets):
+    # Concatenated (weighted) code counts of all the targets of the samples of a node
+    counts = np.zeros(code_offsets[-1])
+    for i in idx:
+        for t in range(codes.shape[1]):
+            counts[code_offsets[t] + codes[i, t]] += weights[i]
+    return counts
+
+
+@njit(cache=True)
+def get_regression_codes(y_regression, n_bins):
+    # Bin of every value in a histogram spanning the values of the target
+    codes = np.zeros(y_regression.size, dtype=np.intp)
+    bin_edges = get_bin_edges(y_regression, n_bins)
+    a_min = bin_edges[0]
+    a_max = bin_edges[-1]
+    if a_min == a_max:
+        return codes, 0.0
+
+    for i in range(y_regression.size):
+        # The maximum value falls in the last bin, as in numba_histogram
+        codes[i] = min(int(n_bins * (y_regression[i] - a_min) / (a_max - a_min)), n_bins - 1)
+    return codes, bin_edges[1] - bin_edges[0]
+
+
+def get_target_codes(y, classification_targets, n_bins=N_BINS_REGRESSION):
+    """Encode every target as a discrete code so that node impurities can be computed from counts
+
+    Classification targets are coded by their label and regression targets by their bin in a
+    histogram whose edges are fixed with the values of y.
+
+    :param y: target data
+    :param classification_targets: features that are part of the classification task
+    :param n_bins: number of bins of the regression histograms
+    :return: codes: integer matrix with the code of every value
+             n_codes: number of possible codes of every target
+             bin_widths: width of the histogram bins of every target, 0 for classification targets
+    """
+    n_targets = y.shape[1]
+    codes = np.zeros(y.shape, dtype=np.intp)
+    n_codes = np.zeros(n_targets, dtype=np.intp)
+    bin_widths = np.zeros(n_targets)
+    for i in range(n_targets):
+        if i in classification_targets:
+            codes[:, i] = y[:, i].astype(np.intp)
+            n_codes[i] = codes[:, i].max() + 1
+        else:
+            codes[:, i], bin_widths[i] = get_regression_codes(y[:, i], n_bins)
+            n_codes[i] = n_bins
+    return codes, n_codes, bin_widths
+
+
+class ImpurityEngine:
+    def __init__(self, y, classification_targets=None, sample_weight=None, n_bins=N_BINS_REGRESSION):
+        """Compute the impurity of the nodes of a tree from the counts of their target codes
+
+        The bins of the regression targets are fixed once with the values at the root, so the counts
+        of a node are additive: the counts of a right child are those of its parent minus those of
+        its left sibling.
+
+        :param y: target data at the root of the tree
+        :param classification_targets: features that are part of the classification task
+        :param sample_weight: weight of every sample, samples with weight 0 are not part of the tree
+        :param n_bins: number of bins of the regression histograms
+        """
+        classification_targets = classification_targets if classification_targets else []
+        self.n_targets = y.shape[1]
+        self.codes, self.n_codes, self.bin_widths = get_target_codes(y, classification_targets, n_bins)
+        self.code_offsets = np.concatenate(([0], np.cumsum(self.n_codes)))
+        self.is_classification = np.array([i in classification_targets for i in range(self.n_targets)])
+        self.weights = np.ones(y.shape[0]) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+        self.root_counts = self.node_counts(np.flatnonzero(self.weights))
+        self.root_impurity = self.impurity(self.root_counts, self.weights.sum())
+
+    def node_counts(self, idx):
+        """Count the target codes of a node, each sample counts as many times as its weight
+
+        :param idx: indices of the samples of the node
+        :return: concatenated code counts of all the targets
+        """
+        return node_counts(self.codes, self.weights, idx, self.code_offsets)
+
+    def impurity(self, counts, n):
+        """Impurity of every target of a node
+
+        :param counts: code counts of the node, as returned by node_counts
+        :param n: (weighted) number of samples of the node
+        :return: impurity of every target
+        """
+        return impurity_counts(counts, n, self.code_offsets, self.bin_widths, self.is_classification)
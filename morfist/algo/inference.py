@@ -0,0 +1,310 @@
+import numpy as np
+from numba import njit, prange
+
+from morfist.algo.categorical import bitset_contains
+from morfist.algo.sparse import issparse
+
+# The nodes of a forest are passed to the kernels as the tuple
+# (tree_offsets, category_offsets, is_categorical, features, values, left_children, right_children,
+#  missing_left, categories), see FlatForest
+
+
+@njit(cache=True)
+def goes_left(value, feature, node, t, nodes):
+    # Whether a value of the split feature of a node of tree t goes to its left child
+    _, category_offsets, is_categorical, _, values, _, _, missing_left, categories = nodes
+    if np.isnan(value):
+        return missing_left[node]
+    if feature < is_categorical.size and is_categorical[feature]:
+        return bitset_contains(categories[category_offsets[t] + int(values[node])], value)
+    return value <= values[node]
+
+
+@njit(cache=True)
+def leaf_dense(x, i, t, nodes):
+    # Leaf reached by row i of a dense matrix in tree t
+    tree_offsets, _, _, features, _, left_children, right_children, _, _ = nodes
+    root = tree_offsets[t]
+    node = root
+    feature = features[node]
+    while feature >= 0:
+        if goes_left(x[i, feature], feature, node, t, nodes):
+            node = root + left_children[node]
+        else:
+            node = root + right_children[node]
+        feature = features[node]
+    return node
+
+
+@njit(cache=True)
+def leaf_csr(indptr, indices, data, i, t, nodes):
+    # Leaf reached by row i of a CSR matrix in tree t
+    # The value of a feature is found by binary search in the sorted stored columns of the row,
+    # it is 0 if the feature is not stored
+    tree_offsets, _, _, features, _, left_children, right_children, _, _ = nodes
+    row_features = indices[indptr[i]:indptr[i + 1]]
+    root = tree_offsets[t]
+    node = root
+    feature = features[node]
+    while feature >= 0:
+        value = 0.0
+        p = np.searchsorted(row_features, feature)
+        if p < row_features.size and row_features[p] == feature:
+            value = data[indptr[i] + p]
+        if goes_left(value, feature, node, t, nodes):
+            node = root + left_children[node]
+        else:
+            node = root + right_children[node]
+        feature = features[node]
+    return node
+
+
+@njit(cache=True)
+def add_leaf(i, leaf, leaf_values, shift, labels, label_offsets, sums, squares, votes):
+    # Add the prediction of a leaf, given by its row in leaf_values, to the statistics of row i: a vote for
+    # the predicted class of the classification targets, found in their sorted labels, and the value minus
+    # the shift of the target and its square for the regression targets
+    for j in range(leaf_values.shape[1]):
+        if label_offsets[j + 1] > label_offsets[j]:
+            target_labels = labels[label_offsets[j]:label_offsets[j + 1]]
+            votes[i, label_offsets[j] + np.searchsorted(target_labels, leaf_values[leaf, j])] += 1
+        else:
+            value = leaf_values[leaf, j] - shift[j]
+            sums[i, j] += value
+            squares[i, j] += value * value
+
+
+@njit(parallel=True, cache=True)
+def apply_dense(x, nodes):
+    # Leaf reached by every row in every tree
+    n_trees = nodes[0].size - 1
+    leaves = np.empty((x.shape[0], n_trees), dtype=np.intp)
+    for i in prange(x.shape[0]):
+        for t in range(n_trees):
+            leaves[i, t] = leaf_dense(x, i, t, nodes)
+    return leaves
+
+
+@njit(parallel=True, cache=True)
+def apply_csr(indptr, indices, data, nodes):
+    # Leaf reached by every row of a CSR matrix in every tree
+    n_trees = nodes[0].size - 1
+    leaves = np.empty((indptr.size - 1, n_trees), dtype=np.intp)
+    for i in prange(indptr.size - 1):
+        for t in range(n_trees):
+            leaves[i, t] = leaf_csr(indptr, indices, data, i, t, nodes)
+    return leaves
+
+
+@njit(parallel=True, cache=True)
+def accumulate_dense(x, leaf_offsets, leaf_ids, leaf_values, shift, labels, label_offsets, nodes):
+    # Statistics of the predictions of all the trees for every row, added up one tree at a time
+    n_trees = nodes[0].size - 1
+    sums = np.zeros((x.shape[0], leaf_values.shape[1]))
+    squares = np.zeros((x.shape[0], leaf_values.shape[1]))
+    votes = np.zeros((x.shape[0], labels.size))
+    for i in prange(x.shape[0]):
+        for t in range(n_trees):
+            leaf = leaf_offsets[t] + leaf_ids[leaf_dense(x, i, t, nodes)]
+            add_leaf(i, leaf, leaf_values, shift, labels, label_offsets, sums, squares, votes)
+    return sums, squares, votes
+
+
+@njit(parallel=True, cache=True)
+def accumulate_csr(indptr, indices, data, leaf_offsets, leaf_ids, leaf_values, shift, labels, label_offsets, nodes):
+    # Statistics of the predictions of all the trees for every row of a CSR matrix
+    n_trees = nodes[0].size - 1
+    sums = np.zeros((indptr.size - 1, leaf_values.shape[1]))
+    squares = np.zeros((indptr.size - 1, leaf_values.shape[1]))
+    votes = np.zeros((indptr.size - 1, labels.size))
+    for i in prange(indptr.size - 1):
+        for t in range(n_trees):
+            leaf = leaf_offsets[t] + leaf_ids[leaf_csr(indptr, indices, data, i, t, nodes)]
+            add_leaf(i, leaf, leaf_values, shift, labels, label_offsets, sums, squares, votes)
+    return sums, squares, votes
+
+
+@njit(cache=True)
+def node_depths(left_children, right_children):
+    # Depth of every node, children always come after their parent
+    depths = np.zeros(left_children.size, dtype=np.intp)
+    for node in range(left_children.size):
+        if left_children[node] >= 0:
+            depths[left_children[node]] = depths[node] + 1
+            depths[right_children[node]] = depths[node] + 1
+    return depths
+
+
+@njit(cache=True)
+def decision_paths(leaves, parents, depths):
+    # CSR indices of the nodes visited by every row, found walking up from the leaves it reaches.
+    # The path of a leaf is written backwards so that the nodes of every row are sorted
+    indptr = np.zeros(leaves.shape[0] + 1, dtype=np.intp)
+    for i in range(leaves.shape[0]):
+        indptr[i + 1] = indptr[i]
+        for t in range(leaves.shape[1]):
+            indptr[i + 1] += depths[leaves[i, t]] + 1
+    indices = np.empty(indptr[-1], dtype=np.intp)
+    for i in range(leaves.shape[0]):
+        end = indptr[i]
+        for t in range(leaves.shape[1]):
+            end += depths[leaves[i, t]] + 1
+            node = leaves[i, t]
+            for p in range(end - 1, end - depths[leaves[i, t]] - 2, -1):
+                indices[p] = node
+                node = parents[node]
+    return indptr, indices
+
+
+def _get_offsets(sizes):
+    # Start of every block of a concatenation, followed by the total size
+    return np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+
+
+class FlatForest:
+    # Arrays that make up a flat forest, in the order they are stored in a model file
+    ARRAYS = ('tree_offsets',
+              'leaf_offsets',
+              'category_offsets',
+              'is_categorical',
+              'features',
+              'values',
+              'left_children',
+              'right_children',
+              'missing_left',
+              'leaf_ids',
+              'n',
+              'leaf_values',
+              'categories')
+    # Arrays of a tree with one element per node
+    NODE_ARRAYS = ('features', 'values', 'left_children', 'right_children', 'missing_left', 'leaf_ids', 'n')
+
+    def __init__(self, trees):
+        """Nodes of fitted trees stored contiguously, one array per field, to evaluate them in compiled code
+
+        The arrays of the trees are concatenated, so the nodes of tree t are nodes tree_offsets[t] to
+        tree_offsets[t + 1] - 1 and its root is the first one. Children, leaf ids and the values of the
+        categorical splits stay relative to their tree: the prediction of leaf node l of tree t is
+        leaf_values[leaf_offsets[t] + leaf_ids[l]].
+
+        :param trees: fitted MixedRandomTree instances, with the same categorical features
+        """
+        n_words = max([tree.categories.shape[1] for tree in trees] + [1])
+        categorical_features = trees[0].categorical_features if trees else []
+        is_categorical = np.zeros(max(categorical_features, default=-1) + 1, dtype=bool)
+        is_categorical[categorical_features] = True
+        categories = [np.pad(tree.categories, ((0, 0), (0, n_words - tree.categories.shape[1]))) for tree in trees]
+
+        arrays = {name: np.concatenate([getattr(tree, name) for tree in trees]) for name in self.NODE_ARRAYS}
+        arrays['tree_offsets'] = _get_offsets([tree.features.size for tree in trees])
+        arrays['leaf_offsets'] = _get_offsets([tree.leaf_values.shape[0] for tree in trees])
+        arrays['category_offsets'] = _get_offsets([tree.categories.shape[0] for tree in trees])
+        arrays['is_categorical'] = is_categorical
+        arrays['leaf_values'] = np.concatenate([tree.leaf_values for tree in trees])
+        arrays['categories'] = np.vstack([np.zeros((0, n_words), dtype=np.uint64)] + categories)
+        self._set_arrays(arrays)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Build a flat forest on existing arrays without copying them, e.g. memory-mapped from a model file
+
+        :param arrays: dictionary with every array in FlatForest.ARRAYS
+        :return: the flat forest
+        """
+        flat_forest = cls.__new__(cls)
+        flat_forest._set_arrays(arrays)
+        return flat_forest
+
+    def _set_arrays(self, arrays):
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        # The regression values are added up around the mean of their leaves, so that the squares do not
+        # lose precision to cancellation when the values are far from 0. It is computed once, the leaf
+        # values are read as they are by the kernels, without a copy
+        if self.leaf_values.shape[0] > 0:
+            self.shift = np.asarray(self.leaf_values.mean(axis=0, dtype=np.float64))
+        else:
+            self.shift = np.zeros(self.leaf_values.shape[1])
+
+    def _nodes(self):
+        return (self.tree_offsets,
+                self.category_offsets,
+                self.is_categorical,
+                self.features,
+                self.values,
+                self.left_children,
+                self.right_children,
+                self.missing_left,
+                self.categories)
+
+    def get_tree_arrays(self, t):
+        """Views of the arrays of one tree
+
+        :param t: index of the tree
+        :return: dictionary with the arrays of the tree, named as the attributes of MixedRandomTree
+        """
+        nodes = slice(self.tree_offsets[t], self.tree_offsets[t + 1])
+        arrays = {name: getattr(self, name)[nodes] for name in self.NODE_ARRAYS}
+        arrays['leaf_values'] = self.leaf_values[self.leaf_offsets[t]:self.leaf_offsets[t + 1]]
+        arrays['categories'] = self.categories[self.category_offsets[t]:self.category_offsets[t + 1]]
+        return arrays
+
+    def apply(self, x):
+        """Leaf reached by every instance in every tree
+
+        :param x: dense array or CSR matrix, in the floating point type of the trees
+        :return: matrix with the global index of the leaf reached in each tree
+        """
+        if issparse(x):
+            return apply_csr(x.indptr, x.indices, x.data, self._nodes())
+        return apply_dense(x, self._nodes())
+
+    def decision_path(self, x):
+        """Nodes visited by every instance in every tree
+
+        :param x: dense array or CSR matrix, in the floating point type of the trees
+        :return: indptr and indices of a CSR matrix with one row per instance and one column per node, the
+                 indices of every row are the sorted global indices of the nodes it visits
+        """
+        offsets = np.repeat(self.tree_offsets[:-1], np.diff(self.tree_offsets))
+        internal = np.flatnonzero(self.features >= 0)
+        left_children = np.full(self.features.size, -1, dtype=np.intp)
+        right_children = np.full(self.features.size, -1, dtype=np.intp)
+        left_children[internal] = self.left_children[internal] + offsets[internal]
+        right_children[internal] = self.right_children[internal] + offsets[internal]
+        parents = np.full(self.features.size, -1, dtype=np.intp)
+        parents[left_children[internal]] = internal
+        parents[right_children[internal]] = internal
+        return decision_paths(self.apply(x), parents, node_depths(left_children, right_children))
+
+    def accumulate(self, x, labels):
+        """Add up the predictions of all the trees for every instance, without storing them
+
+        Memory is proportional to the number of instances and targets, not to the number of trees.
+
+        :param x: dense array or CSR matrix, in the floating point type of the trees
+        :param labels: dictionary with the sorted labels of every classification target
+        :return: sums of the predictions of every target and sums of their squared deviations from the mean
+                 of the trees, which are 0 for the classification targets, and a dictionary with the matrix
+                 of votes of every classification target, with one column per label
+        """
+        # The labels of all the classification targets are concatenated, the votes of target j are columns
+        # label_offsets[j] to label_offsets[j + 1] - 1, and the regression targets have no column
+        n_classes = np.zeros(self.leaf_values.shape[1], dtype=np.intp)
+        for j, target_labels in labels.items():
+            n_classes[j] = target_labels.size
+        label_offsets = _get_offsets(n_classes)
+        all_labels = np.concatenate([np.zeros(0)] + [np.asarray(labels[j], dtype=np.float64)
+                                                     for j in np.flatnonzero(n_classes > 0)])
+        shift = np.where(n_classes > 0, 0, self.shift)
+
+        stats = (self.leaf_offsets, self.leaf_ids, self.leaf_values, shift, all_labels, label_offsets)
+        if issparse(x):
+            sums, squares, votes = accumulate_csr(x.indptr, x.indices, x.data, *stats, self._nodes())
+        else:
+            sums, squares, votes = accumulate_dense(x, *stats, self._nodes())
+        n_trees = self.tree_offsets.size - 1
+        squares -= sums ** 2 / n_trees
+        sums += n_trees * shift
+        class_votes = {int(j): votes[:, label_offsets[j]:label_offsets[j + 1]] for j in np.flatnonzero(n_classes > 0)}
+        return sums, squares, class_votes
@@ -0,0 +1,76 @@
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'MORFIST\x00'
+# Version of the layout, increased on every incompatible change
+VERSION = 1
+# Arrays start at multiples of this number of bytes, so that memory-mapped views are aligned
+ALIGNMENT = 64
+# Version and size of the header, after the magic bytes
+PREFIX = struct.Struct('<IQ')
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_model_file(path, header, arrays):
+    """Write arrays to a model file
+
+    The file has the magic bytes, the version and the size of the header, a JSON header and then every array,
+    contiguous and aligned. The header describes the dtype, shape and offset of every array.
+
+    :param path: path of the file
+    :param header: JSON serializable dictionary
+    :param arrays: dictionary with the arrays to write
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+    header = json.dumps(dict(header, arrays=layout)).encode('utf-8')
+    data_start = _align(len(MAGIC) + PREFIX.size + len(header))
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(PREFIX.pack(VERSION, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.write(bytes(data_start + layout[name]['offset'] - f.tell()))
+            f.write(memoryview(array.reshape(-1)).cast('B'))
+
+
+def read_model_file(path, mmap=True):
+    """Read the arrays of a model file
+
+    :param path: path of the file
+    :param mmap: whether to memory-map the file instead of reading it. The arrays are then copy-on-write views
+                 of the file: processes that load the same file share its pages and nothing is read until
+                 it is used
+    :return: the header and the dictionary of arrays
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a morfist model file'.format(path))
+        version, header_size = PREFIX.unpack(f.read(PREFIX.size))
+        if version != VERSION:
+            raise ValueError('Unsupported model file version {}, expected {}'.format(version, VERSION))
+        header = json.loads(f.read(header_size).decode('utf-8'))
+    data_start = _align(len(MAGIC) + PREFIX.size + header_size)
+
+    if mmap:
+        buffer = np.memmap(path, dtype=np.uint8, mode='c')
+    else:
+        buffer = np.fromfile(path, dtype=np.uint8)
+    arrays = {}
+    for name, spec in header.pop('arrays').items():
+        dtype = np.dtype(spec['dtype'])
+        start = data_start + spec['offset']
+        size = int(np.prod(spec['shape'])) * dtype.itemsize
+        arrays[name] = buffer[start:start + size].view(dtype).reshape(spec['shape'])
+    return header, arrays
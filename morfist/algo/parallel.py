@@ -0,0 +1,39 @@
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def get_n_jobs(n_jobs):
+    # Number of worker processes to use, following the scikit-learn convention
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(os.cpu_count() + 1 + n_jobs, 1)
+    return max(n_jobs, 1)
+
+
+def share_array(a):
+    """Copy an array into a new shared memory block
+
+    :param a: array to be shared
+    :return: the shared memory block and the (name, shape, dtype) spec needed to attach to it
+    """
+    a = np.ascontiguousarray(a)
+    shm = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+    shared = np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)
+    shared[...] = a
+    return shm, (shm.name, a.shape, a.dtype.str)
+
+
+def attach_array(spec):
+    """Attach to an array previously shared with share_array
+
+    :param spec: the (name, shape, dtype) spec returned by share_array
+    :return: the shared memory block and a read-only array view on it
+    """
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    a = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    a.flags.writeable = False
+    return shm, a
@@ -0,0 +1,94 @@
+import numpy as np
+from numba import njit
+
+
+def issparse(x):
+    # Duck-typed check for scipy.sparse matrices, so that scipy does not need to be imported
+    return hasattr(x, 'tocsc') and hasattr(x, 'nnz')
+
+
+def as_float_array(x, dtype, sparse_format='csc'):
+    """Convert the data to the given floating point type, keeping sparse matrices sparse
+
+    :param x: dense array or scipy.sparse matrix
+    :param dtype: floating point type of the result
+    :param sparse_format: format of the sparse result, 'csc' for column access or 'csr' for row access
+    :return: the data as a dense array or as a sparse matrix with sorted indices and no duplicates
+    """
+    if not issparse(x):
+        return np.asarray(x, dtype=dtype)
+    x = x.asformat(sparse_format).astype(dtype, copy=False)
+    x.sum_duplicates()
+    return x
+
+
+@njit(cache=True)
+def csc_columns(indptr, indices, data, idx, features):
+    # Dense values of some columns of a CSC matrix for the rows in idx
+    # Implicit zeros are never visited: for every column, either its stored entries are looked up
+    # in the sorted rows of the node or the rows of the node are looked up in its stored entries,
+    # whichever is smaller
+    columns = np.zeros((idx.size, features.size), dtype=data.dtype)
+    order = np.argsort(idx)
+    sorted_idx = idx[order]
+    for k in range(features.size):
+        start = indptr[features[k]]
+        end = indptr[features[k] + 1]
+        column_rows = indices[start:end]
+        if end - start < idx.size:
+            positions = np.searchsorted(sorted_idx, column_rows)
+            for p in range(column_rows.size):
+                j = positions[p]
+                if j < sorted_idx.size and sorted_idx[j] == column_rows[p]:
+                    columns[order[j], k] = data[start + p]
+        else:
+            positions = np.searchsorted(column_rows, idx)
+            for j in range(idx.size):
+                p = positions[j]
+                if p < column_rows.size and column_rows[p] == idx[j]:
+                    columns[j, k] = data[start + p]
+    return columns
+
+
+@njit(cache=True)
+def csc_node_entries(indptr, indices, data, sorted_idx, feature):
+    # Stored values of a column of a CSC matrix for the rows of a node, given sorted, and their rows
+    # Implicit zeros are never visited: either the stored entries of the column are looked up in the rows
+    # of the node or the rows of the node are looked up in the stored entries, whichever is smaller
+    start = indptr[feature]
+    end = indptr[feature + 1]
+    column_rows = indices[start:end]
+    n_entries = min(end - start, sorted_idx.size)
+    rows = np.empty(n_entries, dtype=np.intp)
+    values = np.empty(n_entries, dtype=data.dtype)
+    n_entries = 0
+    if end - start < sorted_idx.size:
+        positions = np.searchsorted(sorted_idx, column_rows)
+        for p in range(column_rows.size):
+            j = positions[p]
+            if j < sorted_idx.size and sorted_idx[j] == column_rows[p]:
+                rows[n_entries] = column_rows[p]
+                values[n_entries] = data[start + p]
+                n_entries += 1
+    else:
+        positions = np.searchsorted(column_rows, sorted_idx)
+        for j in range(sorted_idx.size):
+            p = positions[j]
+            if p < column_rows.size and column_rows[p] == sorted_idx[j]:
+                rows[n_entries] = sorted_idx[j]
+                values[n_entries] = data[start + p]
+                n_entries += 1
+    return rows[:n_entries], values[:n_entries]
+
+
+def get_columns(x, idx, features):
+    """Dense values of some features for some samples
+
+    :param x: dense array or CSC matrix
+    :param idx: indices of the samples
+    :param features: indices of the features
+    :return: matrix with one row per sample and one column per feature
+    """
+    if issparse(x):
+        return csc_columns(x.indptr, x.indices, x.data, idx, features)
+    return x[np.ix_(idx, features)]
@@ -1,7 +1,104 @@
+import inspect
+import json
+import multiprocessing
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-import scipy.stats
 
+from morfist.algo.binning import bin_data, get_bin_thresholds
+from morfist.algo.evaluation import accuracy, rmse
+from morfist.algo.inference import FlatForest
+from morfist.algo.model_file import read_model_file, write_model_file
+from morfist.algo.parallel import attach_array, get_n_jobs, share_array
+from morfist.algo.sparse import as_float_array, issparse
 from morfist.core.MixedRandomTree import MixedRandomTree
+from morfist.core.MixedSplitter import check_dtype, check_random_state
+
+MAX_INT = np.iinfo(np.int32).max
+# Rows predicted at a time by iter_predict and predict_chunks
+CHUNK_SIZE = 65536
+
+# Training data shared with the worker processes, set by _init_worker
+_worker_data = {}
+
+
+def _get_n_samples(max_samples, n_train):
+    # Number of samples drawn for each tree
+    if max_samples is None:
+        return n_train
+    if isinstance(max_samples, float):
+        if not 0 < max_samples <= 1:
+            raise ValueError('max_samples must be in (0, 1] when it is a float, got {}'.format(max_samples))
+        return max(int(round(max_samples * n_train)), 1)
+    if not 0 < max_samples <= n_train:
+        raise ValueError('max_samples must be in [1, {}] when it is an int, got {}'.format(n_train, max_samples))
+    return max_samples
+
+
+def _get_sample_counts(random_state, n_train, n_samples=None, bootstrap=True):
+    # Sample of a tree as the number of times each training sample is drawn
+    n_samples = n_train if n_samples is None else n_samples
+    random_state = np.random.RandomState(random_state)
+    if bootstrap:
+        sample_idx = random_state.randint(0, n_train, n_samples)
+    elif n_samples < n_train:
+        sample_idx = random_state.choice(n_train, n_samples, replace=False)
+    else:
+        sample_idx = np.arange(n_train)
+    return np.bincount(sample_idx, minlength=n_train)
+
+
+def _fit_tree(tree, x, y, sample_weight=None, bin_thresholds=None, x_binned=None, n_samples=None, bootstrap=True):
+    # Fit a single tree on a random sample drawn from the tree's own seed
+    # It is a random forest so the trees are built with random subsets of the data,
+    # represented by weights over the original arrays instead of copies of them
+    weights = _get_sample_counts(tree.random_state, x.shape[0], n_samples, bootstrap).astype(np.float64)
+    if sample_weight is not None:
+        weights *= sample_weight
+
+    tree.fit(x, y, weights, bin_thresholds, x_binned)
+    return tree
+
+
+def _iter_chunks(x, chunk_size):
+    # Blocks of rows of the data: a .npy file is memory-mapped and an array, memmap or sparse matrix is
+    # sliced, so that only one block is in memory at a time. Any other iterable is taken as the blocks
+    if isinstance(x, (str, os.PathLike)):
+        x = np.load(x, mmap_mode='r')
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be positive, got {}'.format(chunk_size))
+    if isinstance(x, np.ndarray) or issparse(x):
+        for start in range(0, x.shape[0], chunk_size):
+            yield x[start:start + chunk_size]
+    else:
+        yield from x
+
+
+def _get_mp_context():
+    # Start method of the worker processes, forkserver where it is available
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def _init_worker(specs, params):
+    # Attach the worker process to the training data kept in shared memory
+    _worker_data['shm'] = []
+    _worker_data['arrays'] = dict(params)
+    for key, spec in specs.items():
+        shm, _worker_data['arrays'][key] = attach_array(spec)
+        _worker_data['shm'].append(shm)
+
+    arrays = _worker_data['arrays']
+    if 'x_sparse' in arrays:
+        matrix_type, shape = arrays.pop('x_sparse')
+        arrays['x'] = matrix_type((arrays.pop('x_data'), arrays.pop('x_indices'), arrays.pop('x_indptr')), shape=shape)
+
+
+def _fit_tree_worker(tree):
+    return _fit_tree(tree, **_worker_data['arrays'])
 
 
 class MixedRandomForest:
@@ -23,7 +120,23 @@ class MixedRandomForest:
                  max_features='sqrt',
                  min_samples_leaf=5,
                  choose_split='mean',
-                 classification_targets=None):
+                 classification_targets=None,
+                 n_jobs=None,
+                 random_state=None,
+                 splitter='random',
+                 max_bins=255,
+                 split_values='random',
+                 max_depth=None,
+                 max_leaf_nodes=None,
+                 min_impurity_decrease=0.0,
+                 oob_score=False,
+                 warm_start=False,
+                 grace_period=200,
+                 split_confidence=1e-7,
+                 bootstrap=True,
+                 max_samples=None,
+                 dtype=np.float64,
+                 categorical_features=None):
         """Build a printable Random Forest model
 
         :param n_estimators: number of trees in the forest
@@ -31,78 +144,468 @@ class MixedRandomForest:
         :param min_samples_leaf: minimum amount of samples in each leaf
         :param choose_split: method to use to find the best split
         :param classification_targets: features that are part of the classification task
+        :param n_jobs: number of processes used to fit the trees, -1 means using all processors
+        :param random_state: seed used to derive the seed of every tree in the forest
+        :param splitter: strategy used to find the split values
+                             'random': one random midpoint between the values of each feature is tried
+                             'hist': features are quantized once into bins and every bin boundary is tried
+        :param max_bins: maximum number of bins per feature used by the 'hist' splitter, at most 255
+        :param split_values: values tried for each feature by the 'random' splitter
+                                 'random': a single random midpoint between the values of the feature
+                                 'best': every midpoint, evaluated in one sweep over the sorted values
+        :param max_depth: maximum depth of the trees, None means unlimited
+        :param max_leaf_nodes: maximum number of leaves of each tree, trees are grown best-first when it is given
+        :param min_impurity_decrease: minimum gain, weighted by the fraction of samples in the node, to split it
+        :param oob_score: whether to estimate the generalization score with the out-of-bag samples
+        :param warm_start: whether to keep the trees of the previous call to fit and only add the missing ones
+        :param grace_period: number of samples a leaf receives in partial_fit between split attempts
+        :param split_confidence: probability of a wrong split decision in partial_fit, used in the Hoeffding bound
+        :param bootstrap: whether the samples of each tree are drawn with replacement
+        :param max_samples: number of samples drawn for each tree, a fraction of the training samples if it is a float,
+                            all of them if None
+        :param dtype: floating point type of the data, the split values and the predictions, float32 or float64
+        :param categorical_features: features whose values are category codes, split into subsets of categories
         """
         self.n_estimators = n_estimators
         self.min_samples_leaf = min_samples_leaf
         self.max_features = max_features
         self.classification_targets = classification_targets if classification_targets else []
         self.choose_split = choose_split
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.splitter = splitter
+        self.max_bins = max_bins
+        self.split_values = split_values
+        self.max_depth = max_depth
+        self.max_leaf_nodes = max_leaf_nodes
+        self.min_impurity_decrease = min_impurity_decrease
+        self.oob_score = oob_score
+        self.warm_start = warm_start
+        self.grace_period = grace_period
+        self.split_confidence = split_confidence
+        self.bootstrap = bootstrap
+        self.max_samples = max_samples
+        self.dtype = dtype
+        self.categorical_features = categorical_features if categorical_features else []
+        self.n_features = 0
         self.n_targets = 0
         self.classification_labels = {}
         self.estimators = []
+        self._stream_random_state = None
+        # Nodes of all the trees in contiguous arrays, built on the first prediction after training
+        self._flat_forest = None
+
+    def __getstate__(self):
+        # The flat forest is a copy of the nodes of the trees, it is rebuilt on the first prediction
+        state = self.__dict__.copy()
+        state['_flat_forest'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
 
     # Fit the model
-    def fit(self, x, y):
-        self.estimators = []
+    def fit(self, x, y, sample_weight=None):
+        """Fit the forest
 
+        :param x: training data, a dense array or a scipy.sparse matrix
+        :param y: target data
+        :param sample_weight: weight of every sample, each sample counts as many times as its weight,
+                              e.g. the number of times it appears in pre-aggregated data
+        """
+        # The data is converted once, the trees and the worker processes share it in this type
+        dtype = check_dtype(self.dtype)
+        x = as_float_array(x, dtype, 'csc')
+        y = np.asarray(y, dtype=dtype)
         if y.ndim == 1:
             y = y.reshape((y.size, 1))
-        self.n_targets = y.shape[1]
 
-        # Get the classification labels
-        # It takes the unique labels of the specified classification variables
-        for i in filter(lambda j: j in self.classification_targets, range(self.n_targets)):
-            self.classification_labels[i] = np.unique(y[:, i])
+        if self.warm_start and len(self.estimators) > 0:
+            self._check_warm_start(x, y)
+        else:
+            self.estimators = []
+            self.n_features = x.shape[1]
+            self.n_targets = y.shape[1]
+
+            # Get the classification labels
+            # It takes the unique labels of the specified classification variables
+            self.classification_labels = {}
+            for i in filter(lambda j: j in self.classification_targets, range(self.n_targets)):
+                self.classification_labels[i] = np.unique(y[:, i])
+
+        trees = self._make_trees()
+
+        # The features are quantized once for all the trees
+        bin_thresholds = None
+        x_binned = None
+        if self.splitter == 'hist':
+            if issparse(x):
+                raise ValueError("The 'hist' splitter does not support sparse input")
+            bin_thresholds = get_bin_thresholds(x, self.max_bins)
+            x_binned = bin_data(x, bin_thresholds)
+
+        if sample_weight is not None:
+            sample_weight = np.asarray(sample_weight, dtype=np.float64)
+            if sample_weight.shape != (x.shape[0],) or (sample_weight < 0).any():
+                raise ValueError('sample_weight must be a non-negative array with one weight per sample')
+            if sample_weight.sum() == 0:
+                raise ValueError('sample_weight must have at least one positive weight')
+
+        if self.oob_score and not self.bootstrap and self.max_samples is None:
+            raise ValueError('Out-of-bag score is only available if bootstrap=True or max_samples is given')
 
-        n_train = x.shape[0]
         # Train the random trees that are part of the forest
-        for i in range(self.n_estimators):
-            m = MixedRandomTree(self.max_features,
-                                self.min_samples_leaf,
-                                self.choose_split,
-                                self.classification_targets)
+        arrays = {'x': x, 'y': y, 'sample_weight': sample_weight, 'x_binned': x_binned}
+        params = {'bin_thresholds': bin_thresholds,
+                  'n_samples': _get_n_samples(self.max_samples, x.shape[0]),
+                  'bootstrap': self.bootstrap}
+        n_jobs = min(get_n_jobs(self.n_jobs), len(trees))
+        if n_jobs <= 1:
+            trees = [_fit_tree(m, **arrays, **params) for m in trees]
+        else:
+            trees = self._fit_parallel(trees, arrays, params, n_jobs)
+        self.estimators = self.estimators + trees
+        self._flat_forest = None
 
-            # It is a random forest so the trees are built with random subsets of the data
-            sample_idx = np.random.choice(np.arange(n_train),
-                                          n_train,
-                                          replace=True)
+        if self.oob_score:
+            self._set_oob_score(x, y)
 
-            m.fit(x[sample_idx, :], y[sample_idx, :])
-            self.estimators.append(m)
+    def _make_trees(self):
+        # Every tree gets its own seed, so the forest does not depend on the number of workers
+        # The seeds of a warm started forest continue the sequence, so it matches a forest trained at once
+        seeds = check_random_state(self.random_state).randint(MAX_INT, size=self.n_estimators)
+        seeds = seeds[len(self.estimators):]
+        return [self._make_tree(seed) for seed in seeds]
 
-    # Predict the class/value of an instance
-    def predict(self, x):
-        n_test = x.shape[0]
-        pred = np.zeros((n_test, self.n_targets, self.n_estimators))
-        for i, m in enumerate(self.estimators):
-            pred[:, :, i] = m.predict(x)
+    def _make_tree(self, seed):
+        return MixedRandomTree(max_features=self.max_features,
+                               min_samples_leaf=self.min_samples_leaf,
+                               choose_split=self.choose_split,
+                               classification_targets=self.classification_targets,
+                               random_state=seed,
+                               splitter=self.splitter,
+                               split_values=self.split_values,
+                               max_depth=self.max_depth,
+                               max_leaf_nodes=self.max_leaf_nodes,
+                               min_impurity_decrease=self.min_impurity_decrease,
+                               grace_period=self.grace_period,
+                               split_confidence=self.split_confidence,
+                               dtype=self.dtype,
+                               categorical_features=self.categorical_features)
+
+    def partial_fit(self, x, y, sample_weight=None):
+        """Update the forest with a batch of samples, growing its trees incrementally
+
+        Each tree sees every sample a Poisson(1) number of times, the online equivalent of
+        the bootstrap (Oza and Russell, 2001), and grows as described in MixedRandomTree.partial_fit.
+
+        :param x: batch of training data
+        :param y: batch of target data
+        :param sample_weight: weight of every sample of the batch
+        """
+        dtype = check_dtype(self.dtype)
+        x = as_float_array(x, dtype, 'csr')
+        y = np.asarray(y, dtype=dtype)
+        if y.ndim == 1:
+            y = y.reshape((y.size, 1))
+        if sample_weight is None:
+            sample_weight = np.ones(x.shape[0])
+        sample_weight = np.asarray(sample_weight, dtype=np.float64)
+
+        if len(self.estimators) == 0:
+            if sample_weight.sum() == 0:
+                raise ValueError('sample_weight must have at least one positive weight')
+            self.n_features = x.shape[1]
+            self.n_targets = y.shape[1]
+            self.classification_labels = {}
+            self.estimators = self._make_trees()
+        else:
+            self._check_shape(x, y)
+
+        if self._stream_random_state is None:
+            self._stream_random_state = check_random_state(self.random_state)
+
+        # The labels seen so far
+        for i in filter(lambda j: j in self.classification_targets, range(self.n_targets)):
+            self.classification_labels[i] = np.union1d(self.classification_labels.get(i, []), y[:, i])
+
+        for m in self.estimators:
+            weights = sample_weight * self._stream_random_state.poisson(1, x.shape[0])
+            # A tree that has not received any sample would predict the placeholder value of its root,
+            # so it gets one sample of the batch if its draw left it empty
+            if m.n.sum() == 0 and not weights.any() and sample_weight.any():
+                i = self._stream_random_state.choice(np.flatnonzero(sample_weight))
+                weights[i] = sample_weight[i]
+            m.partial_fit(x, y, weights)
+        self._flat_forest = None
 
-        pred_avg = np.zeros((n_test, self.n_targets))
+    def _check_shape(self, x, y):
+        # The new data must have the number of features and targets the existing trees were trained on
+        if x.shape[1] != self.n_features or y.shape[1] != self.n_targets:
+            raise ValueError('Expected {} features and {} targets, got {} and {}'.format(
+                self.n_features, self.n_targets, x.shape[1], y.shape[1]))
+
+    def _check_warm_start(self, x, y):
+        # The new data must have the same layout as the data the existing trees were trained on
+        if self.n_estimators < len(self.estimators):
+            raise ValueError('n_estimators={} must be larger or equal to the number of trees already fitted '
+                             '({}) when warm_start is used'.format(self.n_estimators, len(self.estimators)))
+        self._check_shape(x, y)
+        for i, labels in self.classification_labels.items():
+            if not np.isin(np.unique(y[:, i]), labels).all():
+                raise ValueError('Target {} has labels that were not seen by the fitted trees'.format(i))
+        if self.n_estimators == len(self.estimators):
+            warnings.warn('Fitting with warm_start and the same n_estimators does not add any tree.')
+
+    @staticmethod
+    def _fit_parallel(trees, arrays, params, n_jobs):
+        # The training data is placed in shared memory once instead of being pickled for every tree
+        arrays = dict(arrays)
+        params = dict(params)
+        if issparse(arrays['x']):
+            # A sparse matrix is shared as its three arrays and rebuilt by every worker
+            x = arrays.pop('x')
+            arrays.update(x_data=x.data, x_indices=x.indices, x_indptr=x.indptr)
+            params['x_sparse'] = (type(x), x.shape)
+        shared = {key: share_array(a) for key, a in arrays.items() if a is not None}
+        specs = {key: spec for key, (_, spec) in shared.items()}
+        try:
+            # The workers are not forked from this process, so they do not inherit the thread pool of the
+            # parallel prediction kernels, which can hang forked processes at exit with the TBB threading layer
+            with ProcessPoolExecutor(max_workers=n_jobs,
+                                     mp_context=_get_mp_context(),
+                                     initializer=_init_worker,
+                                     initargs=(specs, params)) as executor:
+                return list(executor.map(_fit_tree_worker, trees))
+        finally:
+            for shm, _ in shared.values():
+                shm.close()
+                shm.unlink()
+
+    def _set_oob_score(self, x, y):
+        # Predict every training sample with the trees that did not see it during training
+        x = as_float_array(x, x.dtype, 'csr')
+        n_train = x.shape[0]
+        n_samples = _get_n_samples(self.max_samples, n_train)
+        n_oob = np.zeros(n_train)
+        pred_sum = np.zeros((n_train, self.n_targets))
+        votes = {i: np.zeros((n_train, int(labels.max()) + 1)) for i, labels in self.classification_labels.items()}
+        for m in self.estimators:
+            oob_idx = np.flatnonzero(_get_sample_counts(m.random_state, n_train, n_samples, self.bootstrap) == 0)
+            pred = m.predict(x[oob_idx, :])
+            n_oob[oob_idx] += 1
+            pred_sum[oob_idx, :] += pred
+            for i in votes:
+                votes[i][oob_idx, pred[:, i].astype(int)] += 1
+
+        oob = n_oob > 0
+        if not oob.all():
+            warnings.warn('Some samples were never left out of a bootstrap sample, '
+                          'they are not used in the out-of-bag score.')
+
+        self.oob_prediction_ = np.full((n_train, self.n_targets), np.nan)
+        self.oob_prediction_[oob, :] = pred_sum[oob, :] / n_oob[oob, None]
+        self.oob_score_ = np.zeros(self.n_targets)
         for i in range(self.n_targets):
-            # Predict categorical value
+            # Accuracy for the classification targets and RMSE for the regression ones, as in cross_validation
             if i in self.classification_targets:
-                pred_avg[:, i], _ = scipy.stats.mode(pred[:, i, :].T)
-            # Predict numerical value
+                self.oob_prediction_[oob, i] = np.argmax(votes[i][oob, :], axis=1)
+                self.oob_score_[i] = accuracy(y[oob, i], self.oob_prediction_[oob, i])
             else:
-                pred_avg[:, i] = pred[:, i, :].mean(axis=1)
+                self.oob_score_[i] = rmse(y[oob, i], self.oob_prediction_[oob, i])
+
+    def _get_flat_forest(self):
+        # The trees are flattened once after every change and evaluated together by a compiled kernel
+        if self._flat_forest is None:
+            self._flat_forest = FlatForest(self.estimators)
+        return self._flat_forest
+
+    def _accumulate(self, x):
+        # Sums and squared deviations of the predictions of the trees, and their votes for every class,
+        # computed in one pass without storing the prediction of every tree
+        x = as_float_array(x, check_dtype(self.dtype), 'csr')
+        return self._get_flat_forest().accumulate(x, self.classification_labels)
+
+    # Predict the class/value of an instance
+    def predict(self, x, return_std=False):
+        """Predict the class of the classification targets and the value of the regression targets
+
+        :param x: instances to predict
+        :param return_std: whether to also return the standard deviation of the predictions of the trees
+                           for the regression targets
+        :return: matrix with one row per instance and one column per target. Classification targets get the
+                 class with most votes, the smallest one in case of a tie, and regression targets the mean
+                 of the trees. If return_std is True, also the matrix of standard deviations, which is NaN
+                 for the classification targets
+        """
+        dtype = check_dtype(self.dtype)
+        sums, deviations, votes = self._accumulate(x)
+        n_trees = len(self.estimators)
+
+        pred_avg = sums / n_trees
+        for i in votes:
+            pred_avg[:, i] = self.classification_labels[i][np.argmax(votes[i], axis=1)]
+        if not return_std:
+            return pred_avg.astype(dtype)
+
+        # Rounding can make the sum of the squared deviations slightly negative
+        pred_std = np.sqrt(np.maximum(deviations / n_trees, 0))
+        pred_std[:, list(votes)] = np.nan
+        return pred_avg.astype(dtype), pred_std.astype(dtype)
+
+    def apply(self, x):
+        """Find the leaf reached by every instance in every tree
+
+        The prediction of tree t for the instances is tree.leaf_values[tree.leaf_ids[leaves[:, t]]], with
+        tree = estimators[t], so it can be recomputed with a gather if the leaf values change.
+
+        :param x: instances
+        :return: int32 matrix with one row per instance and one column per tree, with the index of the
+                 leaf in the nodes of the tree
+        """
+        x = as_float_array(x, check_dtype(self.dtype), 'csr')
+        flat_forest = self._get_flat_forest()
+        return (flat_forest.apply(x) - flat_forest.tree_offsets[:-1]).astype(np.int32)
+
+    def decision_path(self, x):
+        """Find the nodes visited by every instance in every tree
+
+        :param x: instances
+        :return: CSR indicator matrix with one row per instance and one column per node of the forest, which
+                 is 1 for the nodes that the instance visits, and the array n_nodes_ptr such that the
+                 columns of tree t are n_nodes_ptr[t] to n_nodes_ptr[t + 1] - 1
+        """
+        # scipy is only imported when it is needed
+        import scipy.sparse
 
-        return pred_avg
+        x = as_float_array(x, check_dtype(self.dtype), 'csr')
+        flat_forest = self._get_flat_forest()
+        indptr, indices = flat_forest.decision_path(x)
+        indicator = scipy.sparse.csr_matrix((np.ones(indices.size, dtype=np.int8), indices, indptr),
+                                            shape=(x.shape[0], flat_forest.features.size))
+        return indicator, flat_forest.tree_offsets.copy()
+
+    def iter_predict(self, x, chunk_size=CHUNK_SIZE, return_std=False):
+        """Predict the data one block of rows at a time, so that memory depends on the size of the blocks
+        and not on the size of the data
+
+        :param x: path of a .npy file, which is memory-mapped, array, np.memmap, sparse matrix or iterable
+                  of blocks of rows
+        :param chunk_size: number of rows of every block, not used for iterables of blocks
+        :param return_std: whether to also return the standard deviation of the trees, as in predict
+        :return: generator with the prediction of every block, as returned by predict
+        """
+        for chunk in _iter_chunks(x, chunk_size):
+            yield self.predict(chunk, return_std=return_std)
+
+    def predict_chunks(self, x, chunk_size=CHUNK_SIZE, out=None):
+        """Predict the data one block of rows at a time, writing the predictions to an output array
+
+        :param x: path of a .npy file, which is memory-mapped, array, np.memmap, sparse matrix or iterable
+                  of blocks of rows
+        :param chunk_size: number of rows of every block, not used for iterables of blocks
+        :param out: array with one row per instance and one column per target, for example a writable
+                    np.memmap, where the predictions are written. If None, a new array is returned
+        :return: the predictions
+        """
+        if out is None:
+            predictions = list(self.iter_predict(x, chunk_size))
+            if not predictions:
+                return np.zeros((0, self.n_targets), dtype=check_dtype(self.dtype))
+            return np.vstack(predictions)
+
+        start = 0
+        for prediction in self.iter_predict(x, chunk_size):
+            if start + prediction.shape[0] > out.shape[0]:
+                raise ValueError('out has {} rows, fewer than the data'.format(out.shape[0]))
+            out[start:start + prediction.shape[0]] = prediction
+            start += prediction.shape[0]
+        if start != out.shape[0]:
+            raise ValueError('out has {} rows, but the data has {}'.format(out.shape[0], start))
+        if isinstance(out, np.memmap):
+            out.flush()
+        return out
 
     # Predict the probability of an instance
     def predict_proba(self, x):
-        n_test = x.shape[0]
-        pred = np.zeros((n_test, self.n_targets, self.n_estimators))
-        for i, m in enumerate(self.estimators):
-            pred[:, :, i] = m.predict(x)
+        """Predict the class probabilities of the classification targets
 
-        pred_avg = np.zeros((n_test, self.n_targets), dtype=object)
-        for i in range(self.n_targets):
-            if i in self.classification_targets:
-                for j in range(n_test):
-                    freq = np.bincount(pred[j, i, :].T.astype(int),
-                                       minlength=self.classification_labels[i].size)
-                    pred_avg[j, i] = freq / self.n_estimators
-            else:
-                pred_avg[:, i] = pred[:, i, :].mean(axis=1)
+        :param x: instances to predict
+        :return: list with a matrix for every classification target, in the order of classification_targets,
+                 with one row per instance and one column per class, in the order of classification_labels.
+                 The probability of a class is the fraction of trees that predict it
+        """
+        _, _, votes = self._accumulate(x)
+        return [(votes[i] / len(self.estimators)).astype(check_dtype(self.dtype))
+                for i in self.classification_targets]
+
+    def compact(self, tolerance=0.0):
+        """Collapse the splits of every tree whose children are leaves with the same prediction,
+        see MixedRandomTree.compact
+
+        :param tolerance: largest difference between the predictions of the regression targets of two leaves
+                          that are merged, 0 only merges identical leaves
+        :return: dictionary with the number of nodes of the forest and the mean length of the decision paths,
+                 which traversal time is proportional to, before and after compaction
+        """
+        report = {'n_nodes_before': sum(tree.features.size for tree in self.estimators),
+                  'mean_depth_before': np.mean([tree._mean_depth() for tree in self.estimators])}
+        for tree in self.estimators:
+            tree.compact(tolerance)
+        self._flat_forest = None
+        report['n_nodes_after'] = sum(tree.features.size for tree in self.estimators)
+        report['mean_depth_after'] = np.mean([tree._mean_depth() for tree in self.estimators])
+        return report
+
+    def save(self, path):
+        """Save the fitted forest to a model file
+
+        The file holds a versioned header with the parameters of the forest and the nodes of all the trees in
+        contiguous arrays, that load can memory-map. The random number generators of the forest are not saved,
+        so a loaded forest continues partial_fit with a new one.
+
+        :param path: path of the file
+        """
+        if len(self.estimators) == 0:
+            raise ValueError('The forest must be fitted before it is saved')
+        params = {name: getattr(self, name) for name in inspect.signature(MixedRandomForest).parameters}
+        params['dtype'] = np.dtype(self.dtype).name
+        if not isinstance(self.random_state, (int, np.integer)):
+            params['random_state'] = None
+        labels = {str(i): labels.tolist() for i, labels in self.classification_labels.items()}
+        header = {'params': params,
+                  'n_features': self.n_features,
+                  'n_targets': self.n_targets,
+                  'classification_labels': labels,
+                  'tree_random_states': [tree.random_state for tree in self.estimators]}
+        # numpy scalars, e.g. the seeds of the trees, are written as Python numbers
+        header = json.loads(json.dumps(header, default=lambda value: value.item()))
+        flat_forest = self._get_flat_forest()
+        write_model_file(path, header, {name: getattr(flat_forest, name) for name in FlatForest.ARRAYS})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load a forest saved with save
+
+        :param path: path of the file
+        :param mmap: whether to memory-map the file. The trees then use views of the file without copying it,
+                     so loading is immediate and processes that load the same file share its memory
+        :return: the forest
+        """
+        header, arrays = read_model_file(path, mmap)
+        params = header['params']
+        params['dtype'] = np.dtype(params['dtype']).type
+        forest = cls(**params)
+        forest.n_features = header['n_features']
+        forest.n_targets = header['n_targets']
+        forest.classification_labels = {int(i): np.array(labels)
+                                        for i, labels in header['classification_labels'].items()}
 
-        return pred_avg
+        forest._flat_forest = FlatForest.from_arrays(arrays)
+        for t, seed in enumerate(header['tree_random_states']):
+            tree = forest._make_tree(seed)
+            tree.n_targets = forest.n_targets
+            for name, array in forest._flat_forest.get_tree_arrays(t).items():
+                setattr(tree, name, array)
+            forest.estimators.append(tree)
+        return forest
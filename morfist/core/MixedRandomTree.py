@@ -1,6 +1,58 @@
+import heapq
+from collections import deque
+
 import numpy as np
 
-from morfist.core.MixedSplitter import MixedSplitter
+from morfist.algo.binning import floor_to_dtype
+from morfist.algo.categorical import append_bitset, bitset_categories, in_bitset
+from morfist.algo.inference import FlatForest, node_depths
+from morfist.algo.sparse import as_float_array, get_columns, issparse
+from morfist.core.MixedSplitter import MixedSplitter, check_dtype, check_random_state, get_max_features
+
+
+class _StreamingLeaf:
+    def __init__(self, n_features, n_targets, classification_targets, depth, dtype=np.float64):
+        """Sufficient statistics of a leaf grown by partial_fit
+
+        :param n_features: number of features
+        :param n_targets: number of targets
+        :param classification_targets: features that are part of the classification task
+        :param depth: depth of the leaf in the tree
+        :param dtype: floating point type of the samples kept by the leaf
+        """
+        self.classification_targets = classification_targets
+        self.depth = depth
+        self.n = 0.0
+        self.y_sum = np.zeros(n_targets)
+        self.class_counts = {i: np.zeros(0) for i in classification_targets}
+        # Most recent samples of the leaf, used to look for its split
+        self.x = np.zeros((0, n_features), dtype=dtype)
+        self.y = np.zeros((0, n_targets), dtype=dtype)
+        self.weights = np.zeros(0)
+        self.n_new = 0
+
+    def update(self, x, y, weights, buffer_size):
+        # Add a batch of samples to the statistics and keep the last buffer_size ones
+        self.n += weights.sum()
+        self.y_sum += weights @ y
+        for i in self.classification_targets:
+            counts = np.bincount(y[:, i].astype(int), weights=weights)
+            size = max(counts.size, self.class_counts[i].size)
+            self.class_counts[i] = np.pad(self.class_counts[i], (0, size - self.class_counts[i].size))
+            self.class_counts[i][:counts.size] += counts
+
+        # The last samples are copied, a view would keep the whole batch alive
+        self.x = np.concatenate((self.x, x))[-buffer_size:].copy()
+        self.y = np.concatenate((self.y, y))[-buffer_size:].copy()
+        self.weights = np.concatenate((self.weights, weights))[-buffer_size:].copy()
+        self.n_new += x.shape[0]
+
+    def value(self):
+        # Prediction of the leaf: majority class or mean value of every target
+        value = self.y_sum / self.n
+        for i in self.classification_targets:
+            value[i] = np.argmax(self.class_counts[i])
+        return value
 
 
 class MixedRandomTree:
@@ -8,117 +60,453 @@ class MixedRandomTree:
                  max_features='sqrt',
                  min_samples_leaf=5,
                  choose_split='mean',
-                 classification_targets=None):
+                 classification_targets=None,
+                 random_state=None,
+                 splitter='random',
+                 split_values='random',
+                 max_depth=None,
+                 max_leaf_nodes=None,
+                 min_impurity_decrease=0.0,
+                 grace_period=200,
+                 split_confidence=1e-7,
+                 dtype=np.float64,
+                 categorical_features=None):
         """Build a Random Tree
 
         :param max_features: the number of features to consider when looking for the best split
         :param min_samples_leaf: minimum amount of samples in each leaf
         :param choose_split: method used to find the best split
         :param classification_targets: features that are part of the classification task
+        :param random_state: seed used to draw the random feature and value choices
+        :param splitter: strategy used to find the split values, 'random' or 'hist'
+        :param split_values: values tried for each feature by the 'random' splitter, 'random' or 'best'
+        :param max_depth: maximum depth of the tree, None means unlimited
+        :param max_leaf_nodes: maximum number of leaves, the tree is grown best-first when it is given
+        :param min_impurity_decrease: minimum gain, weighted by the fraction of samples in the node, to split it
+        :param grace_period: number of samples a leaf receives in partial_fit between split attempts,
+                             it is also the number of recent samples each leaf keeps to look for a split
+        :param split_confidence: probability of a wrong split decision in partial_fit, used in the Hoeffding bound
+        :param dtype: floating point type of the data, the split values and the predictions, float32 or float64
+        :param categorical_features: features whose values are category codes, split into subsets of categories
         """
         self.min_samples_leaf = min_samples_leaf
         self.max_features = max_features
         self.classification_targets = classification_targets if classification_targets else []
         self.choose_split = choose_split
+        self.random_state = random_state
+        self.splitter = splitter
+        self.split_values = split_values
+        self.max_depth = max_depth
+        self.max_leaf_nodes = max_leaf_nodes
+        self.min_impurity_decrease = min_impurity_decrease
+        self.grace_period = grace_period
+        self.split_confidence = split_confidence
+        self.dtype = dtype
+        self.categorical_features = categorical_features if categorical_features else []
         self.n_targets = 0
-        self.features = []
-        self.values = []
-        self.leaf_values = []
-        self.left_children = []
-        self.right_children = []
-        self.n = []
-
-    def fit(self, x, y):
+        # Nodes are stored in typed arrays: the split feature of every node, -1 for the leaves, its split value
+        # in dtype, NaN for the leaves, and its children, -1 for the leaves
+        self.features = np.zeros(0, dtype=np.int32)
+        self.values = np.zeros(0)
+        self.left_children = np.zeros(0, dtype=np.int32)
+        self.right_children = np.zeros(0, dtype=np.int32)
+        # Predictions are only stored for the leaves, leaf_ids is the row of every leaf in leaf_values
+        # and -1 for the internal nodes
+        self.leaf_ids = np.zeros(0, dtype=np.int32)
+        self.leaf_values = np.zeros((0, 0))
+        self.n = np.zeros(0)
+        # Whether the samples with a missing value of the split feature go to the left child
+        self.missing_left = np.zeros(0, dtype=bool)
+        # Bitsets of the categorical splits, the value of a categorical split is its row in this table
+        self.categories = np.zeros((0, 0), dtype=np.uint64)
+        self._stream = None
+
+    def fit(self, x, y, sample_weight=None, bin_thresholds=None, x_binned=None):
+        """Fit the tree
+
+        :param x: training data, a dense array or a scipy.sparse matrix
+        :param y: target data
+        :param sample_weight: weight of every sample, each sample counts as many times as its weight
+                              and samples with weight 0 are left out, e.g. bootstrap multiplicities
+        :param bin_thresholds: bin boundaries of every feature for the 'hist' splitter,
+                               computed from x if not given
+        :param x_binned: x already quantized with bin_thresholds
+        """
+        dtype = check_dtype(self.dtype)
+        x = as_float_array(x, dtype, 'csc')
+        y = np.asarray(y, dtype=dtype)
         if y.ndim == 1:
             y = y.reshape((y.size, 1))
 
         self.n_targets = y.shape[1]
+        if sample_weight is None:
+            sample_weight = np.ones(x.shape[0])
+        sample_weight = np.asarray(sample_weight, dtype=np.float64)
 
         splitter = MixedSplitter(x,
                                  y,
                                  self.max_features,
                                  self.min_samples_leaf,
                                  self.choose_split,
-                                 self.classification_targets)
+                                 self.classification_targets,
+                                 self.random_state,
+                                 self.splitter,
+                                 bin_thresholds,
+                                 x_binned,
+                                 self.split_values,
+                                 sample_weight,
+                                 self.categorical_features)
 
+        n_train = sample_weight.sum()
         split_features = []
         split_values = []
         leaf_values = []
         left_children = []
         right_children = []
         n_i = []
+        missing_left = []
+        categories = np.zeros((0, 0), dtype=np.uint64)
+
+        # Nodes are ranges of a single permutation of the sample indices, partitioned in place
+        sample_idx = np.flatnonzero(sample_weight)
+        # Nodes waiting to be split, a FIFO queue grows the tree breadth-first
+        # and a heap on the gain of the splits grows it best-first when the number of leaves is limited
+        best_first = self.max_leaf_nodes is not None
+        split_queue = [] if best_first else deque()
 
-        split_queue = [(x, y)]
-        i = 0
-        # Build the tree until all values are covered
-        while len(split_queue) > 0:
-            next_x, next_y = split_queue.pop(0)
+        def add_node(start, end, counts, depth):
+            # Add a leaf to the tree and queue its best split, if it can be split
+            idx = sample_idx[start:end]
+            node = len(split_features)
 
-            leaf_values.append(self._make_leaf(next_y))
-            n_i.append(next_y.shape[0])
+            weights = sample_weight[idx]
+            leaf_values.append(self._make_leaf(y[idx, :], weights))
+            n_i.append(weights.sum())
+            split_features.append(-1)
+            split_values.append(np.nan)
+            missing_left.append(False)
+            left_children.append(-1)
+            right_children.append(-1)
 
-            feature, value, impurity = splitter.split(next_x, next_y)
+            if self.max_depth is not None and depth >= self.max_depth:
+                return node
 
-            split_features.append(feature)
-            split_values.append(value)
-            if feature:
-                left_children.append(i + len(split_queue) + 1)
-                right_children.append(i + len(split_queue) + 2)
+            feature, value, gain, nan_left = splitter.split(idx, counts)
+            # The gain is weighted by the fraction of the samples that reach the node
+            if feature is not None and n_i[node] / n_train * gain >= self.min_impurity_decrease:
+                candidate = (-gain, node, start, end, counts, depth, feature, value, nan_left)
+                if best_first:
+                    heapq.heappush(split_queue, candidate)
+                else:
+                    split_queue.append(candidate)
+            return node
 
-                l_idx = next_x[:, feature] <= value
-                r_idx = next_x[:, feature] > value
+        # The target counts of every node are kept with it so they are only computed for left children,
+        # the counts of a right child are those of its parent minus the left ones
+        add_node(0, sample_idx.size, splitter.impurity.root_counts, 0)
+        n_leaves = 1
+        # Build the tree until all values are covered or the maximum number of leaves is reached
+        while len(split_queue) > 0 and (not best_first or n_leaves < self.max_leaf_nodes):
+            if best_first:
+                _, node, start, end, counts, depth, feature, value, nan_left = heapq.heappop(split_queue)
+            else:
+                _, node, start, end, counts, depth, feature, value, nan_left = split_queue.popleft()
+            idx = sample_idx[start:end]
 
-                split_queue.append((next_x[l_idx, :], next_y[l_idx, :]))
-                split_queue.append((next_x[r_idx, :], next_y[r_idx, :]))
+            column = get_columns(x, idx, np.array([feature]))[:, 0]
+            if feature in self.categorical_features:
+                l_idx = in_bitset(column, value)
+                categories = append_bitset(categories, value)
+                value = categories.shape[0] - 1
             else:
-                left_children.append(None)
-                right_children.append(None)
+                # The split value is stored in the type of the data, without changing the partition
+                value = floor_to_dtype(value, dtype)
+                l_idx = column <= value
+            # Missing values go to the child chosen by the splitter
+            l_idx |= nan_left & np.isnan(column)
+            n_left = np.count_nonzero(l_idx)
+            idx[:] = np.concatenate((idx[l_idx], idx[~l_idx]))
+            left_counts = splitter.impurity.node_counts(idx[:n_left])
 
-            i += 1
+            split_features[node] = feature
+            split_values[node] = value
+            missing_left[node] = nan_left
+            left_children[node] = add_node(start, start + n_left, left_counts, depth + 1)
+            right_children[node] = add_node(start + n_left, end, counts - left_counts, depth + 1)
+            n_leaves += 1
 
-        self.features = np.array(split_features)
-        self.values = np.array(split_values)
-        self.leaf_values = np.array(leaf_values)
-        self.left_children = np.array(left_children)
-        self.right_children = np.array(right_children)
+        self.features = np.array(split_features, dtype=np.int32)
+        self.values = np.array(split_values, dtype=dtype)
+        self.left_children = np.array(left_children, dtype=np.int32)
+        self.right_children = np.array(right_children, dtype=np.int32)
+        # Every node got a prediction when it was added, only those of the leaves are kept
+        is_leaf = self.features < 0
+        self.leaf_ids = np.where(is_leaf, np.cumsum(is_leaf) - 1, -1).astype(np.int32)
+        self.leaf_values = np.array(leaf_values, dtype=dtype).reshape((-1, self.n_targets))[is_leaf]
         self.n = np.array(n_i)
+        self.missing_left = np.array(missing_left, dtype=bool)
+        self.categories = categories
+        self._stream = None
 
-    def _make_leaf(self, y):
-        y_ = np.zeros(self.n_targets)
-        for i in range(self.n_targets):
-            if i in self.classification_targets:
-                y_[i] = np.argmax(np.bincount(y[:, i].astype(int)))
+    def partial_fit(self, x, y, sample_weight=None):
+        """Update the tree with a batch of samples, growing it incrementally
+
+        Every leaf keeps the statistics needed for its prediction and its last grace_period samples.
+        Each time a leaf receives grace_period new samples, the best split of those samples is found
+        for each candidate feature and the leaf is split if the best one is significantly better than the
+        second best according to the Hoeffding bound (Domingos and Hulten, 2000).
+        The memory used by a leaf does not depend on the number of samples seen.
+
+        :param x: batch of training data, sparse batches are made dense
+        :param y: batch of target data
+        :param sample_weight: weight of every sample of the batch
+        """
+        dtype = check_dtype(self.dtype)
+        x = as_float_array(x, dtype, 'csr')
+        if issparse(x):
+            x = x.toarray()
+        y = np.asarray(y, dtype=dtype)
+        if y.ndim == 1:
+            y = y.reshape((y.size, 1))
+        if sample_weight is None:
+            sample_weight = np.ones(x.shape[0])
+        sample_weight = np.asarray(sample_weight, dtype=np.float64)
+
+        if self._stream is None:
+            self._start_stream(x.shape[1], y.shape[1])
+        self._stream['n'] += sample_weight.sum()
+
+        leaves = self._apply(x)
+        for node in np.unique(leaves):
+            rows = np.flatnonzero((leaves == node) & (sample_weight > 0))
+            if rows.size == 0:
+                continue
+            leaf = self._stream['leaves'][node]
+            leaf.update(x[rows, :], y[rows, :], sample_weight[rows], self.grace_period)
+            self.n[node] = leaf.n
+            self.leaf_values[self.leaf_ids[node]] = leaf.value()
+            if leaf.n_new >= self.grace_period:
+                leaf.n_new = 0
+                self._try_split(node)
+
+    def _start_stream(self, n_features, n_targets):
+        # Statistics of the leaves, an already fitted tree keeps its leaves and their values
+        dtype = check_dtype(self.dtype)
+        self._stream = {'n_features': n_features,
+                        'random_state': check_random_state(self.random_state),
+                        'leaves': {}}
+        if len(self.features) == 0:
+            self.n_targets = n_targets
+            self.features = np.array([-1], dtype=np.int32)
+            self.values = np.array([np.nan], dtype=dtype)
+            self.missing_left = np.array([False])
+            self.left_children = np.array([-1], dtype=np.int32)
+            self.right_children = np.array([-1], dtype=np.int32)
+            self.leaf_ids = np.array([0], dtype=np.int32)
+            self.leaf_values = np.zeros((1, n_targets), dtype=dtype)
+            self.n = np.zeros(1)
+        self._stream['n'] = self.n[0]
+
+        depth = np.zeros(len(self.features), dtype=int)
+        for node in range(len(self.features)):
+            if self.features[node] >= 0:
+                depth[self.left_children[node]] = depth[node] + 1
+                depth[self.right_children[node]] = depth[node] + 1
             else:
-                y_[i] = y[:, i].mean()
-        return y_
+                leaf = self._new_leaf(depth[node])
+                # The statistics start from the fitted leaf, as if all its samples had its value
+                leaf.n = self.n[node]
+                leaf.y_sum = self.leaf_values[self.leaf_ids[node]] * self.n[node]
+                for i in self.classification_targets:
+                    leaf.class_counts[i] = np.zeros(int(self.leaf_values[self.leaf_ids[node], i]) + 1)
+                    leaf.class_counts[i][-1] = self.n[node]
+                self._stream['leaves'][node] = leaf
 
-    def predict(self, x):
-        n_test = x.shape[0]
-        prediction = np.zeros((n_test, self.n_targets))
+    def _new_leaf(self, depth):
+        return _StreamingLeaf(self._stream['n_features'],
+                              self.n_targets,
+                              self.classification_targets,
+                              depth,
+                              self.leaf_values.dtype)
+
+    def _try_split(self, node):
+        # Split a leaf if the gain of its best split is significant according to the Hoeffding bound
+        leaf = self._stream['leaves'][node]
+        n_leaves = len(self._stream['leaves'])
+        if self.max_depth is not None and leaf.depth >= self.max_depth:
+            return
+        if self.max_leaf_nodes is not None and n_leaves >= self.max_leaf_nodes:
+            return
+
+        n_features = self._stream['n_features']
+        random_state = self._stream['random_state']
+        splitter = MixedSplitter(leaf.x,
+                                 leaf.y,
+                                 self.max_features,
+                                 self.min_samples_leaf,
+                                 self.choose_split,
+                                 self.classification_targets,
+                                 random_state,
+                                 self.splitter,
+                                 split_values=self.split_values,
+                                 sample_weight=leaf.weights,
+                                 categorical_features=self.categorical_features)
+
+        # Best split of each of the candidate features
+        idx = np.flatnonzero(leaf.weights)
+        try_features = random_state.choice(n_features, get_max_features(self.max_features, n_features), replace=False)
+        candidates = [splitter.split(idx, features=np.array([f])) for f in try_features]
+        gains = sorted((c[2] for c in candidates if c[0] is not None), reverse=True)
+        if len(gains) == 0 or gains[0] <= 0:
+            return
+        feature, value, gain, nan_left = next(c for c in candidates if c[0] is not None and c[2] == gains[0])
+
+        # Hoeffding bound on the ratio between the two best gains (Ikonomovska et al., 2011),
+        # the ratio does not depend on the scale of the gains and its range is 1
+        hoeffding_bound = np.sqrt(np.log(1 / self.split_confidence) / (2 * leaf.weights.sum()))
+        second_gain = max(gains[1], 0) if len(gains) > 1 else 0
+        if second_gain / gain >= 1 - hoeffding_bound:
+            return
+        if leaf.n / self._stream['n'] * gain < self.min_impurity_decrease:
+            return
+
+        if feature in self.categorical_features:
+            l_idx = in_bitset(leaf.x[:, feature], value)
+            self.categories = append_bitset(self.categories, value)
+            value = self.categories.shape[0] - 1
+        else:
+            value = floor_to_dtype(value, self.values.dtype)
+            l_idx = leaf.x[:, feature] <= value
+        l_idx |= nan_left & np.isnan(leaf.x[:, feature])
+        self.features[node] = feature
+        self.values[node] = value
+        self.missing_left[node] = nan_left
+        self.left_children[node] = len(self.features)
+        self.right_children[node] = len(self.features) + 1
+        self.features = np.append(self.features, np.array([-1, -1], dtype=np.int32))
+        self.values = np.append(self.values, np.full(2, np.nan, dtype=self.values.dtype))
+        self.missing_left = np.append(self.missing_left, [False, False])
+        self.left_children = np.append(self.left_children, np.array([-1, -1], dtype=np.int32))
+        self.right_children = np.append(self.right_children, np.array([-1, -1], dtype=np.int32))
+        # The left child takes the prediction row of its parent and the right child gets a new one
+        leaf_ids = np.array([self.leaf_ids[node], self.leaf_values.shape[0]], dtype=np.int32)
+        self.leaf_ids = np.append(self.leaf_ids, leaf_ids)
+        self.leaf_ids[node] = -1
+        self.leaf_values = np.vstack((self.leaf_values, np.zeros((1, self.n_targets), dtype=self.leaf_values.dtype)))
+
+        del self._stream['leaves'][node]
+        for child, child_idx in zip((self.left_children[node], self.right_children[node]), (l_idx, ~l_idx)):
+            child_leaf = self._new_leaf(leaf.depth + 1)
+            child_leaf.update(leaf.x[child_idx, :], leaf.y[child_idx, :], leaf.weights[child_idx], self.grace_period)
+            child_leaf.n_new = 0
+            self._stream['leaves'][child] = child_leaf
+            self.leaf_values[self.leaf_ids[child]] = child_leaf.value()
+            self.n = np.append(self.n, child_leaf.n)
+
+    def compact(self, tolerance=0.0):
+        """Collapse the splits whose two children are leaves with the same prediction
+
+        Such splits do not change any prediction but make the tree deeper. A split is collapsed if its children
+        predict the same class for every classification target, and values that differ by at most tolerance
+        for every regression target. The new leaf predicts the mean of its children weighted by their number
+        of samples. Splits are collapsed bottom-up, so whole subtrees with a single prediction become a leaf.
+        The recent samples kept by partial_fit are dropped, it continues from the statistics of the leaves.
 
-        def traverse(x_traverse, test_idx, node_idx):
-            if test_idx.size < 1:
-                return
+        :param tolerance: largest difference between the predictions of the regression targets of two leaves
+                          that are merged, 0 only merges identical leaves
+        :return: number of nodes removed
+        """
+        is_leaf = self.features < 0
+        node_values = np.zeros((self.features.size, self.n_targets))
+        node_values[is_leaf] = self.leaf_values[self.leaf_ids[is_leaf]]
+        regression = np.ones(self.n_targets, dtype=bool)
+        regression[self.classification_targets] = False
+
+        # Children come after their parent, so going backwards the children of a node are already final
+        for node in np.flatnonzero(~is_leaf)[::-1]:
+            left = self.left_children[node]
+            right = self.right_children[node]
+            if not is_leaf[left] or not is_leaf[right]:
+                continue
+            difference = np.abs(node_values[left] - node_values[right])
+            if (difference[~regression] > 0).any() or (difference[regression] > tolerance).any():
+                continue
+            weights = np.array([self.n[left], self.n[right]]) if self.n[left] + self.n[right] > 0 else None
+            # Equal predictions are kept exactly, the mean could round them
+            node_values[node] = np.where(difference == 0,
+                                         node_values[left],
+                                         np.average(node_values[[left, right]], axis=0, weights=weights))
+            is_leaf[node] = True
+
+        # Nodes still reached from the root, renumbered in the same order
+        kept = np.zeros(self.features.size, dtype=bool)
+        kept[0] = True
+        for node in np.flatnonzero(~is_leaf):
+            if kept[node]:
+                kept[self.left_children[node]] = True
+                kept[self.right_children[node]] = True
+        new_index = (np.cumsum(kept) - 1).astype(np.int32)
+        split = kept & ~is_leaf
+        leaf = kept & is_leaf
+
+        # Only the bitsets of the categorical splits that are left are kept
+        categorical = split & np.isin(self.features, self.categorical_features)
+        category_rows = self.values[categorical].astype(int)
+        values = self.values.copy()
+        values[categorical] = np.searchsorted(np.unique(category_rows), category_rows)
+        values[is_leaf] = np.nan
 
-            if not self.features[node_idx]:
-                prediction[test_idx, :] = self.leaf_values[node_idx]
+        n_removed = self.features.size - np.count_nonzero(kept)
+        self.features = np.where(split, self.features, -1).astype(np.int32)[kept]
+        self.values = values[kept].astype(self.values.dtype)
+        self.left_children = np.where(split, new_index[self.left_children], -1).astype(np.int32)[kept]
+        self.right_children = np.where(split, new_index[self.right_children], -1).astype(np.int32)[kept]
+        self.missing_left = (self.missing_left & split)[kept]
+        self.leaf_ids = np.where(leaf, np.cumsum(leaf) - 1, -1).astype(np.int32)[kept]
+        self.leaf_values = node_values[leaf].astype(self.leaf_values.dtype)
+        self.n = self.n[kept]
+        self.categories = self.categories[np.unique(category_rows)]
+        self._stream = None
+        return n_removed
+
+    def _mean_depth(self):
+        # Mean depth of the leaves weighted by their number of samples, the expected length of a decision path
+        depths = node_depths(self.left_children, self.right_children)
+        is_leaf = self.features < 0
+        if self.n[is_leaf].sum() == 0:
+            return depths[is_leaf].mean()
+        return np.average(depths[is_leaf], weights=self.n[is_leaf])
+
+    def _make_leaf(self, y, weights):
+        y_ = np.zeros(self.n_targets)
+        for i in range(self.n_targets):
+            if i in self.classification_targets:
+                y_[i] = np.argmax(np.bincount(y[:, i].astype(int), weights=weights))
             else:
-                left_idx = x_traverse[:, self.features[node_idx]] <= self.values[node_idx]
-                right_idx = x_traverse[:, self.features[node_idx]] > self.values[node_idx]
+                y_[i] = np.average(y[:, i], weights=weights)
+        return y_
 
-                traverse(x_traverse[left_idx, :], test_idx[left_idx], self.left_children[node_idx])
-                traverse(x_traverse[right_idx, :], test_idx[right_idx], self.right_children[node_idx])
+    def _apply(self, x):
+        # Index of the leaf node reached by every instance, the tree is walked by a compiled kernel
+        return FlatForest([self]).apply(x)[:, 0]
 
-        traverse(x, np.arange(n_test), 0)
-        return prediction
+    def predict(self, x):
+        dtype = check_dtype(self.dtype)
+        x = as_float_array(x, dtype, 'csr')
+        return self.leaf_values[self.leaf_ids[self._apply(x)]]
 
     def print(self):
         def print_level(level, i):
-            if self.features[i]:
+            if self.features[i] in self.categorical_features:
+                categories = bitset_categories(self.categories[int(self.values[i])])
+                print('\t' * level + '[{} in {}]:'.format(self.features[i], set(categories.tolist())))
+                print_level(level + 1, self.left_children[i])
+                print_level(level + 1, self.right_children[i])
+            elif self.features[i] >= 0:
                 print('\t' * level + '[{} <= {}]:'.format(self.features[i], self.values[i]))
                 print_level(level + 1, self.left_children[i])
                 print_level(level + 1, self.right_children[i])
             else:
-                print('\t' * level + str(self.leaf_values[i]) + ' ({})'.format(self.n[i]))
+                print('\t' * level + str(self.leaf_values[self.leaf_ids[i]]) + ' ({})'.format(self.n[i]))
 
         print_level(0, 0)
@@ -1,47 +1,13 @@
 import numpy as np
 from numba import njit
 
-from morfist.algo.histogram import numba_histogram
+from morfist.algo.binning import MISSING_BIN, bin_data, get_bin_thresholds
+from morfist.algo.categorical import WORD_SIZE
+from morfist.algo.impurity import ImpurityEngine, impurity_counts
+from morfist.algo.sparse import csc_node_entries, get_columns, issparse
 
 
-@njit
-def impurity_classification(y_classification):
-    # Calculate the impurity value for the classification task
-
-    # Cast to integer
-    y_class = y_classification.astype(np.int8)
-
-    # Calculate frequencies
-    frequency = np.bincount(y_class) / y_class.size
-
-    result = 0
-    for i in range(frequency.size):
-        if frequency[i]:
-            result += frequency[i] * np.log2(frequency[i])
-
-    return 0 - result
-
-
-@njit
-def impurity_regression(y, y_regression):
-    # Calculate the impurity value for the regression task
-
-    if np.unique(y_regression).size < 2:
-        return 0
-
-    n_bins = 100
-    bin_width = (y.max() - y.min()) / n_bins
-
-    frequency, _ = numba_histogram(y_regression, n_bins)
-    frequency_float = frequency.astype(np.float64)
-    frequency_float = (frequency_float / len(y)) / bin_width
-
-    probability = (frequency_float + 1) / (frequency_float.sum() + n_bins)
-
-    return 0 - bin_width * (probability * np.log2(probability)).sum()
-
-
-@njit
+@njit(cache=True)
 def get_gain(imp_n_left, imp_n_right, imp_n, imp_root, n_left, n_right, n_parent):
     impurity_left = imp_n_left / imp_root
     impurity_right = imp_n_right / imp_root
@@ -52,6 +18,773 @@ def get_gain(imp_n_left, imp_n_right, imp_n, imp_root, n_left, n_right, n_parent
     return gain_left + gain_right
 
 
+@njit(cache=True)
+def aggregate_gain(gain, choose_split, target):
+    # Combine the gain of every target into the gain of the split
+    if choose_split == 'mean':
+        return gain.mean()
+    elif choose_split == 'random':
+        return gain[target]
+    else:
+        return gain.max()
+
+
+@njit(cache=True)
+def split_gain(left_counts,
+               parent_counts,
+               n_left,
+               n_parent,
+               impurity_parent,
+               code_offsets,
+               bin_widths,
+               is_classification,
+               root_impurity,
+               choose_split,
+               target):
+    # Gain of a split, the counts of the right child are those of the parent minus the left ones
+    n_right = n_parent - n_left
+    impurity_left = impurity_counts(left_counts, n_left, code_offsets, bin_widths, is_classification)
+    impurity_right = impurity_counts(parent_counts - left_counts, n_right, code_offsets, bin_widths, is_classification)
+    gain = get_gain(impurity_left, impurity_right, impurity_parent, root_impurity, n_left, n_right, n_parent)
+    return aggregate_gain(gain, choose_split, target)
+
+
+@njit(cache=True)
+def split_gain_missing(left_counts,
+                       missing_counts,
+                       n_left,
+                       n_missing,
+                       parent_counts,
+                       n_parent,
+                       impurity_parent,
+                       code_offsets,
+                       bin_widths,
+                       is_classification,
+                       root_impurity,
+                       min_samples_leaf,
+                       choose_split,
+                       target):
+    # Gain of a split whose left counts only include the samples with a value, trying the samples
+    # with a missing value in both children. Returns the best gain and whether they go left, without
+    # missing values in the node they follow the largest child. The gain is -inf if a child is too small
+    gain = -np.inf
+    missing_left = False
+    if n_left >= min_samples_leaf and n_parent - n_left >= min_samples_leaf:
+        gain = split_gain(left_counts,
+                          parent_counts,
+                          n_left,
+                          n_parent,
+                          impurity_parent,
+                          code_offsets,
+                          bin_widths,
+                          is_classification,
+                          root_impurity,
+                          choose_split,
+                          target)
+        missing_left = n_missing == 0 and n_left >= n_parent - n_left
+
+    n_left += n_missing
+    if n_missing > 0 and n_left >= min_samples_leaf and n_parent - n_left >= min_samples_leaf:
+        gain_left = split_gain(left_counts + missing_counts,
+                               parent_counts,
+                               n_left,
+                               n_parent,
+                               impurity_parent,
+                               code_offsets,
+                               bin_widths,
+                               is_classification,
+                               root_impurity,
+                               choose_split,
+                               target)
+        if gain_left > gain:
+            gain, missing_left = gain_left, True
+    return gain, missing_left
+
+
+@njit(cache=True)
+def random_thresholds(x, idx, features, u):
+    # Split value selection(random value subsampling): Boström (2011)
+    #   A random midpoint between two consecutive values of each feature is selected,
+    #   NaN is returned for the features that have a single value in the node
+    thresholds = np.full(features.size, np.nan)
+    for k in range(features.size):
+        values = np.unique(x[idx, features[k]])
+        values = values[~np.isnan(values)]
+        if values.size < 2:
+            continue
+        j = int(u[k] * (values.size - 1))
+        # The midpoint is computed in double precision so that it lies strictly between float32 values
+        thresholds[k] = (np.float64(values[j]) + values[j + 1]) / 2
+    return thresholds
+
+
+@njit(cache=True)
+def random_thresholds_csc(indptr, indices, data, idx, features, u):
+    # Same as random_thresholds for the columns of a CSC matrix, the rows of the node without a stored
+    # value add a single value, 0
+    sorted_idx = np.sort(idx)
+    thresholds = np.full(features.size, np.nan)
+    for k in range(features.size):
+        _, values = csc_node_entries(indptr, indices, data, sorted_idx, features[k])
+        if values.size < idx.size:
+            values = np.concatenate((values, np.zeros(1, dtype=values.dtype)))
+        values = np.unique(values)
+        values = values[~np.isnan(values)]
+        if values.size < 2:
+            continue
+        j = int(u[k] * (values.size - 1))
+        thresholds[k] = (np.float64(values[j]) + values[j + 1]) / 2
+    return thresholds
+
+
+@njit(cache=True)
+def find_split(x,
+               codes,
+               weights,
+               idx,
+               features,
+               thresholds,
+               parent_counts,
+               impurity_parent,
+               code_offsets,
+               bin_widths,
+               is_classification,
+               root_impurity,
+               min_samples_leaf,
+               choose_split,
+               random_targets):
+    # Find the best of the given (feature, threshold) candidates in a single compiled pass
+    n_parent = weights[idx].sum()
+    n_targets = bin_widths.size
+    left_counts = np.zeros(parent_counts.size)
+    missing_counts = np.zeros(parent_counts.size)
+
+    best_feature = -1
+    best_value = np.nan
+    best_gain = -np.inf
+    best_missing_left = False
+    for k in range(features.size):
+        feature = features[k]
+        value = thresholds[k]
+        if np.isnan(value):
+            continue
+
+        left_counts[:] = 0
+        missing_counts[:] = 0
+        n_left = 0.0
+        n_missing = 0.0
+        for i in idx:
+            if np.isnan(x[i, feature]):
+                n_missing += weights[i]
+                for t in range(n_targets):
+                    missing_counts[code_offsets[t] + codes[i, t]] += weights[i]
+            elif x[i, feature] <= value:
+                n_left += weights[i]
+                for t in range(n_targets):
+                    left_counts[code_offsets[t] + codes[i, t]] += weights[i]
+
+        gain, missing_left = split_gain_missing(left_counts,
+                                                missing_counts,
+                                                n_left,
+                                                n_missing,
+                                                parent_counts,
+                                                n_parent,
+                                                impurity_parent,
+                                                code_offsets,
+                                                bin_widths,
+                                                is_classification,
+                                                root_impurity,
+                                                min_samples_leaf,
+                                                choose_split,
+                                                random_targets[k])
+        # If it's better than the previous saved one, save the values
+        if gain > best_gain:
+            best_feature, best_value, best_gain, best_missing_left = feature, value, gain, missing_left
+
+    return best_feature, best_value, best_gain, best_missing_left
+
+
+@njit(cache=True)
+def find_split_sorted(x,
+                      codes,
+                      weights,
+                      idx,
+                      features,
+                      parent_counts,
+                      impurity_parent,
+                      code_offsets,
+                      bin_widths,
+                      is_classification,
+                      root_impurity,
+                      min_samples_leaf,
+                      choose_split,
+                      random_targets):
+    # Find the best midpoint of the given features in one sweep over their sorted values,
+    # updating the target counts of the left child incrementally
+    n_parent = weights[idx].sum()
+    n_targets = bin_widths.size
+    left_counts = np.zeros(parent_counts.size)
+    missing_counts = np.zeros(parent_counts.size)
+
+    best_feature = -1
+    best_value = np.nan
+    best_gain = -np.inf
+    best_missing_left = False
+    for k in range(features.size):
+        feature = features[k]
+        values = x[idx, feature]
+        # Missing values are sorted last
+        order = np.argsort(values)
+        n_values = idx.size - np.isnan(values).sum()
+
+        missing_counts[:] = 0
+        n_missing = 0.0
+        for j in range(n_values, idx.size):
+            i = idx[order[j]]
+            n_missing += weights[i]
+            for t in range(n_targets):
+                missing_counts[code_offsets[t] + codes[i, t]] += weights[i]
+
+        left_counts[:] = 0
+        n_left = 0.0
+        for j in range(n_values - 1):
+            i = idx[order[j]]
+            n_left += weights[i]
+            for t in range(n_targets):
+                left_counts[code_offsets[t] + codes[i, t]] += weights[i]
+
+            value = values[order[j]]
+            next_value = values[order[j + 1]]
+            if value == next_value:
+                continue
+
+            gain, missing_left = split_gain_missing(left_counts,
+                                                    missing_counts,
+                                                    n_left,
+                                                    n_missing,
+                                                    parent_counts,
+                                                    n_parent,
+                                                    impurity_parent,
+                                                    code_offsets,
+                                                    bin_widths,
+                                                    is_classification,
+                                                    root_impurity,
+                                                    min_samples_leaf,
+                                                    choose_split,
+                                                    random_targets[k])
+            if gain > best_gain:
+                best_feature, best_gain, best_missing_left = feature, gain, missing_left
+                best_value = (np.float64(value) + next_value) / 2
+
+    return best_feature, best_value, best_gain, best_missing_left
+
+
+@njit(cache=True)
+def find_split_csc(indptr,
+                   indices,
+                   data,
+                   codes,
+                   weights,
+                   idx,
+                   features,
+                   thresholds,
+                   parent_counts,
+                   impurity_parent,
+                   code_offsets,
+                   bin_widths,
+                   is_classification,
+                   root_impurity,
+                   min_samples_leaf,
+                   choose_split,
+                   random_targets):
+    # Same as find_split for the columns of a CSC matrix, only visiting the stored values of the node.
+    # The counts of the rows without a stored value, the zeros, are those of the node minus the stored ones
+    n_parent = weights[idx].sum()
+    n_targets = bin_widths.size
+    sorted_idx = np.sort(idx)
+    left_counts = np.zeros(parent_counts.size)
+    missing_counts = np.zeros(parent_counts.size)
+    stored_counts = np.zeros(parent_counts.size)
+
+    best_feature = -1
+    best_value = np.nan
+    best_gain = -np.inf
+    best_missing_left = False
+    for k in range(features.size):
+        feature = features[k]
+        value = thresholds[k]
+        if np.isnan(value):
+            continue
+
+        rows, values = csc_node_entries(indptr, indices, data, sorted_idx, feature)
+        left_counts[:] = 0
+        missing_counts[:] = 0
+        stored_counts[:] = 0
+        n_left = 0.0
+        n_missing = 0.0
+        n_stored = 0.0
+        for e in range(rows.size):
+            i = rows[e]
+            n_stored += weights[i]
+            for t in range(n_targets):
+                stored_counts[code_offsets[t] + codes[i, t]] += weights[i]
+            if np.isnan(values[e]):
+                n_missing += weights[i]
+                for t in range(n_targets):
+                    missing_counts[code_offsets[t] + codes[i, t]] += weights[i]
+            elif values[e] <= value:
+                n_left += weights[i]
+                for t in range(n_targets):
+                    left_counts[code_offsets[t] + codes[i, t]] += weights[i]
+        if 0 <= value and rows.size < idx.size:
+            left_counts += parent_counts - stored_counts
+            n_left += n_parent - n_stored
+
+        gain, missing_left = split_gain_missing(left_counts,
+                                                missing_counts,
+                                                n_left,
+                                                n_missing,
+                                                parent_counts,
+                                                n_parent,
+                                                impurity_parent,
+                                                code_offsets,
+                                                bin_widths,
+                                                is_classification,
+                                                root_impurity,
+                                                min_samples_leaf,
+                                                choose_split,
+                                                random_targets[k])
+        if gain > best_gain:
+            best_feature, best_value, best_gain, best_missing_left = feature, value, gain, missing_left
+
+    return best_feature, best_value, best_gain, best_missing_left
+
+
+@njit(cache=True)
+def sweep_value(values, zero_position, j):
+    # Value of position j of the sweep over the sorted stored values of a column with the zeros inserted
+    # at zero_position, -1 if the node has no zeros
+    if j == zero_position:
+        return 0.0
+    if 0 <= zero_position < j:
+        return np.float64(values[j - 1])
+    return np.float64(values[j])
+
+
+@njit(cache=True)
+def find_split_sorted_csc(indptr,
+                          indices,
+                          data,
+                          codes,
+                          weights,
+                          idx,
+                          features,
+                          parent_counts,
+                          impurity_parent,
+                          code_offsets,
+                          bin_widths,
+                          is_classification,
+                          root_impurity,
+                          min_samples_leaf,
+                          choose_split,
+                          random_targets):
+    # Same as find_split_sorted for the columns of a CSC matrix, only sorting the stored values of the node.
+    # The rows without a stored value are a single value, 0, of the sweep, whose counts are those of the node
+    # minus the stored ones
+    n_parent = weights[idx].sum()
+    n_targets = bin_widths.size
+    sorted_idx = np.sort(idx)
+    left_counts = np.zeros(parent_counts.size)
+    missing_counts = np.zeros(parent_counts.size)
+    zero_counts = np.zeros(parent_counts.size)
+
+    best_feature = -1
+    best_value = np.nan
+    best_gain = -np.inf
+    best_missing_left = False
+    for k in range(features.size):
+        feature = features[k]
+        rows, values = csc_node_entries(indptr, indices, data, sorted_idx, feature)
+        has_zeros = rows.size < idx.size
+
+        missing_counts[:] = 0
+        zero_counts[:] = parent_counts
+        n_missing = 0.0
+        n_zeros = n_parent
+        for e in range(rows.size):
+            i = rows[e]
+            n_zeros -= weights[i]
+            for t in range(n_targets):
+                zero_counts[code_offsets[t] + codes[i, t]] -= weights[i]
+            if np.isnan(values[e]):
+                n_missing += weights[i]
+                for t in range(n_targets):
+                    missing_counts[code_offsets[t] + codes[i, t]] += weights[i]
+
+        present = ~np.isnan(values)
+        order = np.argsort(values[present])
+        rows = rows[present][order]
+        values = values[present][order]
+        # The zeros go after the stored values that are not larger than 0
+        zero_position = np.searchsorted(values, 0.0, side='right') if has_zeros else -1
+        n_values = values.size + (1 if has_zeros else 0)
+
+        left_counts[:] = 0
+        n_left = 0.0
+        for j in range(n_values - 1):
+            if j == zero_position:
+                left_counts += zero_counts
+                n_left += n_zeros
+            else:
+                i = rows[j - 1 if 0 <= zero_position < j else j]
+                n_left += weights[i]
+                for t in range(n_targets):
+                    left_counts[code_offsets[t] + codes[i, t]] += weights[i]
+
+            value = sweep_value(values, zero_position, j)
+            next_value = sweep_value(values, zero_position, j + 1)
+            if value == next_value:
+                continue
+
+            gain, missing_left = split_gain_missing(left_counts,
+                                                    missing_counts,
+                                                    n_left,
+                                                    n_missing,
+                                                    parent_counts,
+                                                    n_parent,
+                                                    impurity_parent,
+                                                    code_offsets,
+                                                    bin_widths,
+                                                    is_classification,
+                                                    root_impurity,
+                                                    min_samples_leaf,
+                                                    choose_split,
+                                                    random_targets[k])
+            if gain > best_gain:
+                best_feature, best_gain, best_missing_left = feature, gain, missing_left
+                best_value = (value + next_value) / 2
+
+    return best_feature, best_value, best_gain, best_missing_left
+
+
+@njit(cache=True)
+def find_split_hist(x_binned,
+                    codes,
+                    weights,
+                    idx,
+                    features,
+                    n_bins,
+                    parent_counts,
+                    impurity_parent,
+                    code_offsets,
+                    bin_widths,
+                    is_classification,
+                    root_impurity,
+                    min_samples_leaf,
+                    choose_split,
+                    random_targets):
+    # Find the best bin boundary among the given features by scanning the per-bin target counts,
+    # missing values have their own bin
+    n_parent = weights[idx].sum()
+    n_targets = bin_widths.size
+    n_codes = parent_counts.size
+
+    max_bins = n_bins.max()
+    bin_counts = np.zeros((max_bins, n_codes))
+    bin_sizes = np.zeros(max_bins)
+    left_counts = np.zeros(n_codes)
+    missing_counts = np.zeros(n_codes)
+
+    best_feature = -1
+    best_bin = -1
+    best_gain = -np.inf
+    best_missing_left = False
+    for k in range(features.size):
+        feature = features[k]
+        bin_counts[:] = 0
+        bin_sizes[:] = 0
+        missing_counts[:] = 0
+        n_missing = 0.0
+        for i in idx:
+            b = x_binned[i, feature]
+            if b == MISSING_BIN:
+                n_missing += weights[i]
+                for t in range(n_targets):
+                    missing_counts[code_offsets[t] + codes[i, t]] += weights[i]
+                continue
+            bin_sizes[b] += weights[i]
+            for t in range(n_targets):
+                bin_counts[b, code_offsets[t] + codes[i, t]] += weights[i]
+
+        left_counts[:] = 0
+        n_left = 0.0
+        for b in range(n_bins[feature] - 1):
+            if bin_sizes[b] == 0:
+                # Same partition as the previous boundary
+                continue
+            left_counts += bin_counts[b]
+            n_left += bin_sizes[b]
+
+            gain, missing_left = split_gain_missing(left_counts,
+                                                    missing_counts,
+                                                    n_left,
+                                                    n_missing,
+                                                    parent_counts,
+                                                    n_parent,
+                                                    impurity_parent,
+                                                    code_offsets,
+                                                    bin_widths,
+                                                    is_classification,
+                                                    root_impurity,
+                                                    min_samples_leaf,
+                                                    choose_split,
+                                                    random_targets[k])
+            if gain > best_gain:
+                best_feature, best_bin, best_gain, best_missing_left = feature, b, gain, missing_left
+
+    return best_feature, best_bin, best_gain, best_missing_left
+
+
+@njit(cache=True)
+def best_category_partition(category_counts,
+                            category_sizes,
+                            missing_counts,
+                            n_missing,
+                            n_categories,
+                            u,
+                            random_cut,
+                            parent_counts,
+                            n_parent,
+                            impurity_parent,
+                            code_offsets,
+                            bin_widths,
+                            is_classification,
+                            root_impurity,
+                            min_samples_leaf,
+                            choose_split,
+                            target):
+    # Best partition of the categories of a feature into a left and a right subset, given the target counts
+    # of every category. The categories of the node are ordered by a statistic of one target and only the
+    # splits of this order are tried, as the best binary partition of a target is one of them (Breiman et al.,
+    # 1984): the frequency of the majority class of the node for classification targets, and the mean bin
+    # of the values for regression targets. With random_cut a single random split of the order is tried
+    best_gain = -np.inf
+    best_missing_left = False
+    best_categories = np.zeros(0, dtype=np.intp)
+    present = np.flatnonzero(category_sizes[:n_categories] > 0)
+    if present.size < 2:
+        return best_gain, best_missing_left, best_categories
+
+    start = code_offsets[target]
+    end = code_offsets[target + 1]
+    statistic = np.zeros(present.size)
+    if is_classification[target]:
+        majority = start + np.argmax(parent_counts[start:end])
+        for j in range(present.size):
+            statistic[j] = category_counts[present[j], majority] / category_sizes[present[j]]
+    else:
+        bins = np.arange(end - start)
+        for j in range(present.size):
+            statistic[j] = (category_counts[present[j], start:end] * bins).sum() / category_sizes[present[j]]
+    order = present[np.argsort(statistic)]
+
+    cut = int(u * (order.size - 1))
+    left_counts = np.zeros(parent_counts.size)
+    n_left = 0.0
+    for j in range(order.size - 1):
+        left_counts += category_counts[order[j]]
+        n_left += category_sizes[order[j]]
+        if random_cut and j != cut:
+            continue
+
+        gain, missing_left = split_gain_missing(left_counts,
+                                                missing_counts,
+                                                n_left,
+                                                n_missing,
+                                                parent_counts,
+                                                n_parent,
+                                                impurity_parent,
+                                                code_offsets,
+                                                bin_widths,
+                                                is_classification,
+                                                root_impurity,
+                                                min_samples_leaf,
+                                                choose_split,
+                                                target)
+        if gain > best_gain:
+            best_gain, best_missing_left = gain, missing_left
+            best_categories = order[:j + 1].copy()
+    return best_gain, best_missing_left, best_categories
+
+
+@njit(cache=True)
+def categories_bitset(categories, max_categories):
+    # Bitset of the categories of the left child
+    bitset = np.zeros((max_categories + WORD_SIZE - 1) // WORD_SIZE, dtype=np.uint64)
+    for c in categories:
+        bitset[c // WORD_SIZE] |= np.uint64(1) << np.uint64(c % WORD_SIZE)
+    return bitset
+
+
+@njit(cache=True)
+def find_split_categorical(x,
+                           codes,
+                           weights,
+                           idx,
+                           features,
+                           n_categories,
+                           u,
+                           random_cut,
+                           parent_counts,
+                           impurity_parent,
+                           code_offsets,
+                           bin_widths,
+                           is_classification,
+                           root_impurity,
+                           min_samples_leaf,
+                           choose_split,
+                           random_targets):
+    # Find the best partition of the categories of the given features, see best_category_partition
+    n_parent = weights[idx].sum()
+    n_targets = bin_widths.size
+    n_codes = parent_counts.size
+
+    max_categories = max(n_categories.max(), 1)
+    category_counts = np.zeros((max_categories, n_codes))
+    category_sizes = np.zeros(max_categories)
+    missing_counts = np.zeros(n_codes)
+
+    best_feature = -1
+    best_gain = -np.inf
+    best_missing_left = False
+    best_categories = np.zeros(0, dtype=np.intp)
+    for k in range(features.size):
+        feature = features[k]
+        category_counts[:] = 0
+        category_sizes[:] = 0
+        missing_counts[:] = 0
+        n_missing = 0.0
+        for i in idx:
+            if np.isnan(x[i, feature]):
+                n_missing += weights[i]
+                for t in range(n_targets):
+                    missing_counts[code_offsets[t] + codes[i, t]] += weights[i]
+                continue
+            c = int(x[i, feature])
+            category_sizes[c] += weights[i]
+            for t in range(n_targets):
+                category_counts[c, code_offsets[t] + codes[i, t]] += weights[i]
+
+        gain, missing_left, categories = best_category_partition(category_counts,
+                                                                 category_sizes,
+                                                                 missing_counts,
+                                                                 n_missing,
+                                                                 n_categories[k],
+                                                                 u[k],
+                                                                 random_cut,
+                                                                 parent_counts,
+                                                                 n_parent,
+                                                                 impurity_parent,
+                                                                 code_offsets,
+                                                                 bin_widths,
+                                                                 is_classification,
+                                                                 root_impurity,
+                                                                 min_samples_leaf,
+                                                                 choose_split,
+                                                                 random_targets[k])
+        if gain > best_gain:
+            best_feature, best_gain, best_missing_left, best_categories = feature, gain, missing_left, categories
+
+    return best_feature, categories_bitset(best_categories, max_categories), best_gain, best_missing_left
+
+
+@njit(cache=True)
+def find_split_categorical_csc(indptr,
+                               indices,
+                               data,
+                               codes,
+                               weights,
+                               idx,
+                               features,
+                               n_categories,
+                               u,
+                               random_cut,
+                               parent_counts,
+                               impurity_parent,
+                               code_offsets,
+                               bin_widths,
+                               is_classification,
+                               root_impurity,
+                               min_samples_leaf,
+                               choose_split,
+                               random_targets):
+    # Same as find_split_categorical for the columns of a CSC matrix, only visiting the stored values of the
+    # node. The rows without a stored value are category 0, whose counts are those of the node minus the
+    # stored ones
+    n_parent = weights[idx].sum()
+    n_targets = bin_widths.size
+    n_codes = parent_counts.size
+    sorted_idx = np.sort(idx)
+
+    max_categories = max(n_categories.max(), 1)
+    category_counts = np.zeros((max_categories, n_codes))
+    category_sizes = np.zeros(max_categories)
+    missing_counts = np.zeros(n_codes)
+    stored_counts = np.zeros(n_codes)
+
+    best_feature = -1
+    best_gain = -np.inf
+    best_missing_left = False
+    best_categories = np.zeros(0, dtype=np.intp)
+    for k in range(features.size):
+        rows, values = csc_node_entries(indptr, indices, data, sorted_idx, features[k])
+        category_counts[:] = 0
+        category_sizes[:] = 0
+        missing_counts[:] = 0
+        stored_counts[:] = 0
+        n_missing = 0.0
+        n_stored = 0.0
+        for e in range(rows.size):
+            i = rows[e]
+            n_stored += weights[i]
+            for t in range(n_targets):
+                stored_counts[code_offsets[t] + codes[i, t]] += weights[i]
+            if np.isnan(values[e]):
+                n_missing += weights[i]
+                for t in range(n_targets):
+                    missing_counts[code_offsets[t] + codes[i, t]] += weights[i]
+                continue
+            c = int(values[e])
+            category_sizes[c] += weights[i]
+            for t in range(n_targets):
+                category_counts[c, code_offsets[t] + codes[i, t]] += weights[i]
+        if rows.size < idx.size:
+            category_counts[0] += parent_counts - stored_counts
+            category_sizes[0] += n_parent - n_stored
+
+        gain, missing_left, categories = best_category_partition(category_counts,
+                                                                 category_sizes,
+                                                                 missing_counts,
+                                                                 n_missing,
+                                                                 n_categories[k],
+                                                                 u[k],
+                                                                 random_cut,
+                                                                 parent_counts,
+                                                                 n_parent,
+                                                                 impurity_parent,
+                                                                 code_offsets,
+                                                                 bin_widths,
+                                                                 is_classification,
+                                                                 root_impurity,
+                                                                 min_samples_leaf,
+                                                                 choose_split,
+                                                                 random_targets[k])
+        if gain > best_gain:
+            best_feature, best_gain, best_missing_left, best_categories = features[k], gain, missing_left, categories
+
+    return best_feature, categories_bitset(best_categories, max_categories), best_gain, best_missing_left
+
+
 def get_max_features(max_features, n_features):
     # Maximum number of features to try for the best split
     n_max_features = n_features
@@ -67,6 +800,41 @@ def get_max_features(max_features, n_features):
     return n_max_features
 
 
+def get_n_categories(x, categorical_features):
+    """Number of categories of every feature, checking that categorical features are integer codes
+
+    :param x: training data, a dense array or a CSC matrix
+    :param categorical_features: indices of the categorical features
+    :return: number of categories of every feature, 0 for the numerical ones
+    """
+    n_categories = np.zeros(x.shape[1], dtype=np.intp)
+    for feature in categorical_features:
+        values = get_columns(x, np.arange(x.shape[0]), np.array([feature]))[:, 0]
+        # Missing values are allowed
+        values = values[~np.isnan(values)]
+        if not np.all((values >= 0) & (values == np.floor(values))):
+            raise ValueError('Categorical feature {} must be coded as non-negative integers'.format(feature))
+        n_categories[feature] = int(values.max()) + 1 if values.size else 0
+    return n_categories
+
+
+def check_random_state(seed):
+    # Turn seed into a np.random.RandomState instance
+    if seed is None:
+        return np.random.mtrand._rand
+    if isinstance(seed, np.random.RandomState):
+        return seed
+    return np.random.RandomState(seed)
+
+
+def check_dtype(dtype):
+    # Floating point type used to store the data, the split values and the predictions
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError('dtype must be float32 or float64, got {}'.format(dtype))
+    return dtype
+
+
 class MixedSplitter:
     def __init__(self,
                  x,
@@ -74,99 +842,169 @@ class MixedSplitter:
                  max_features='sqrt',
                  min_samples_leaf=5,
                  choose_split='mean',
-                 classification_targets=None):
+                 classification_targets=None,
+                 random_state=None,
+                 splitter='random',
+                 bin_thresholds=None,
+                 x_binned=None,
+                 split_values='random',
+                 sample_weight=None,
+                 categorical_features=None):
         """Class in charge of finding the best split at every given moment
 
-        :param x: training data
+        :param x: training data, a dense array or a CSC matrix
         :param y: target data
         :param max_features: the number of features to consider when looking for the best split
         :param min_samples_leaf: minimum amount of samples in each leaf
         :param choose_split:  method used to find the best split
         :param classification_targets: features that are part of the classification task
+        :param random_state: seed or np.random.RandomState used to draw the random choices
+        :param splitter: strategy used to find the split values
+                             'random': one random midpoint between the values of each feature is tried
+                             'hist': every boundary of the bins of each feature is tried
+        :param bin_thresholds: bin boundaries of every feature, only used by the 'hist' splitter
+        :param x_binned: training data already quantized with bin_thresholds, only used by the 'hist' splitter
+        :param split_values: values tried for each feature by the 'random' splitter
+                                 'random': a single random midpoint between the values of the feature
+                                 'best': every midpoint, evaluated in one sweep over the sorted values
+        :param sample_weight: weight of every sample, each sample counts as many times as its weight
+        :param categorical_features: features whose values are category codes, split into subsets of categories
         """
+        if splitter not in ('random', 'hist'):
+            raise ValueError("splitter must be 'random' or 'hist', got {!r}".format(splitter))
+        if split_values not in ('random', 'best'):
+            raise ValueError("split_values must be 'random' or 'best', got {!r}".format(split_values))
+        if splitter == 'hist' and issparse(x):
+            raise ValueError("The 'hist' splitter does not support sparse input")
+
+        self.x = x
+        self.y = y
         self.n_train = x.shape[0]
         self.n_features = x.shape[1]
         self.n_targets = y.shape[1]
         self.classification_targets = classification_targets if classification_targets else []
         self.max_features = get_max_features(max_features, self.n_features)
         self.min_samples_leaf = min_samples_leaf
-        self.root_impurity = self.__impurity_node(y)
         self.choose_split = choose_split
-
-    def split(self, x, y):
+        self.random_state = check_random_state(random_state)
+        self.splitter = splitter
+        self.split_values = split_values
+        self.impurity = ImpurityEngine(y, self.classification_targets, sample_weight)
+        self.sparse = issparse(x)
+        self.categorical_features = categorical_features if categorical_features else []
+        self.n_categories = get_n_categories(x, self.categorical_features)
+        self.is_categorical = np.isin(np.arange(self.n_features), self.categorical_features)
+
+        if splitter == 'hist':
+            self.bin_thresholds = bin_thresholds if bin_thresholds is not None else get_bin_thresholds(x)
+            self.x_binned = x_binned if x_binned is not None else bin_data(x, self.bin_thresholds)
+            self.n_bins = np.array([t.size + 1 for t in self.bin_thresholds])
+
+    def split(self, idx, counts=None, features=None):
+        """Find the best split of a node
+
+        :param idx: indices of the training samples that reach the node
+        :param counts: target code counts of the node, as given by the impurity engine,
+                       computed from idx if not given
+        :param features: features to try, max_features random features if not given
+        :return: the best feature, the best value, its gain and whether the samples with a missing value
+                 go to the left child
+        """
+        engine = self.impurity
+        n_node = engine.weights[idx].sum()
         # If there are not enough features in the leaf, stop splitting
-        if x.shape[0] <= self.min_samples_leaf:
-            return None, None, np.inf
+        if n_node <= self.min_samples_leaf:
+            return None, None, np.inf, False
 
-        # Best feature
-        best_feature = None
-        # Best value
-        best_value = None
-        # Best impurity
-        best_impurity = -np.inf
+        if counts is None:
+            counts = self.impurity.node_counts(idx)
 
         # Random selection of the features to try for the best split
-        try_features = np.random.choice(
+        try_features = features if features is not None else self.random_state.choice(
             np.arange(self.n_features),
             self.max_features,
             replace=False
         )
 
-        # Try each of the selected features and find which of them gives the best split(higher impurity)
-        for feature in try_features:
-            # Get the unique possible values for this particular feature
-            values = np.unique(x[:, feature])
-
-            # Split value selection(random value subsampling): Boström (2011)
-            #   Two random feature values are selected, and a split is attempted at their mean
-            if values.size < 2:
-                continue
-            values = (values[:-1] + values[1:]) / 2
-            value = np.random.choice(values)
-
-            # Try to split with this specific combination of feature and value
-            left_idx = x[:, feature] <= value
-            right_idx = x[:, feature] > value
-
-            impurity = self.__impurity_split(y, y[left_idx, :], y[right_idx, :])
-            # If it's better than the previous saved one, save the values
-            if impurity > best_impurity:
-                best_feature, best_value, best_impurity = feature, value, impurity
-
-        return best_feature, best_value, best_impurity
-
-    # Calculate the impurity of a split
-    def __impurity_split(self, y_parent, y_left, y_right):
-        n_left = y_left.shape[0]
-        n_right = y_right.shape[0]
-        if n_left < self.min_samples_leaf or n_right < self.min_samples_leaf:
-            return np.inf
+        # Target used by the 'random' choose_split for each of the features
+        random_targets = self.random_state.randint(self.n_targets, size=try_features.size)
+
+        # The impurity of the parent is computed once for all the candidate splits
+        args = (counts,
+                engine.impurity(counts, n_node),
+                engine.code_offsets,
+                engine.bin_widths,
+                engine.is_classification,
+                engine.root_impurity,
+                max(self.min_samples_leaf, 1),
+                self.choose_split)
+
+        # Numerical and categorical features are searched separately and the best of both splits is kept,
+        # the value of a categorical split is the bitset of the categories that go to the left child
+        categorical = self.is_categorical[try_features]
+        numerical = ~categorical
+        split = (-1, None, -np.inf, False)
+        if numerical.any():
+            split = self._split_numerical(idx, try_features[numerical], random_targets[numerical], args)
+        if categorical.any():
+            split_categorical = self._split_categorical(idx,
+                                                        try_features[categorical],
+                                                        random_targets[categorical],
+                                                        args)
+            if split_categorical[2] > split[2]:
+                split = split_categorical
+
+        if split[0] < 0:
+            return None, None, -np.inf, False
+        return split
+
+    def _split_numerical(self, idx, features, random_targets, args):
+        # Best threshold split of the given numerical features
+        engine = self.impurity
+        if self.splitter == 'hist':
+            feature, bin_idx, gain, missing_left = find_split_hist(self.x_binned,
+                                                                   engine.codes,
+                                                                   engine.weights,
+                                                                   idx,
+                                                                   features,
+                                                                   self.n_bins,
+                                                                   *args,
+                                                                   random_targets)
+            value = self.bin_thresholds[feature][bin_idx] if feature >= 0 else None
+            return feature, value, gain, missing_left
+
+        # The kernels for CSC matrices walk the stored values of the tried columns
+        if self.sparse:
+            x = (self.x.indptr, self.x.indices, self.x.data)
+            kernels = (find_split_sorted_csc, random_thresholds_csc, find_split_csc)
         else:
-            n_parent = y_parent.shape[0]
-
-            gain = get_gain(self.__impurity_node(y_left),
-                            self.__impurity_node(y_right),
-                            self.__impurity_node(y_parent),
-                            self.root_impurity,
-                            n_left,
-                            n_right,
-                            n_parent)
-
-            if self.choose_split == 'mean':
-                return gain.mean()
-            elif self.choose_split == 'random':
-                return np.random.choice(gain)
-            else:
-                return gain.max()
-
-    def __impurity_node(self, y):
-        # Calculate the impurity of a node
-        delta = 0.0001
-        impurity = np.zeros(self.n_targets)
-        # Calculate the impurity value for each of the targets(classification or regression)
-        for i in range(self.n_targets):
-            if i in self.classification_targets:
-                impurity[i] = impurity_classification(y[:, i]) + delta
-            else:
-                impurity[i] = impurity_regression(y, y[:, i]) + delta
-        return impurity
+            x = (self.x,)
+            kernels = (find_split_sorted, random_thresholds, find_split)
+        if self.split_values == 'best':
+            return kernels[0](*x, engine.codes, engine.weights, idx, features, *args, random_targets)
+        u = self.random_state.random_sample(features.size)
+        thresholds = kernels[1](*x, idx, features, u)
+        return kernels[2](*x, engine.codes, engine.weights, idx, features, thresholds, *args, random_targets)
+
+    def _split_categorical(self, idx, features, random_targets, args):
+        # Best partition of the categories of the given categorical features
+        # The 'random' splitter tries a single random partition of each feature, like its numerical splits
+        engine = self.impurity
+        random_cut = self.splitter == 'random' and self.split_values == 'random'
+        u = self.random_state.random_sample(features.size) if random_cut else np.zeros(features.size)
+        if self.sparse:
+            x = (self.x.indptr, self.x.indices, self.x.data)
+            kernel = find_split_categorical_csc
+        else:
+            x = (self.x,)
+            kernel = find_split_categorical
+        return kernel(*x,
+                      engine.codes,
+                      engine.weights,
+                      idx,
+                      features,
+                      self.n_categories[features],
+                      u,
+                      random_cut,
+                      *args,
+                      random_targets)
@@ -0,0 +1,38 @@
+import numpy as np
+
+from morfist.core.MixedRandomForest import MixedRandomForest
+
+
+def warmup(dtypes=(np.float64,), sparse=False):
+    """Compile the numba kernels used by fit and predict ahead of the first real call
+
+    Small forests are trained and used on synthetic data with every splitter, a categorical feature
+    and missing values, so that every kernel is compiled for the given data types. The kernels are
+    cached on disk, so calling it once, e.g. when building an image, also saves the compilation
+    in every later process. Data with a different layout, e.g. Fortran ordered arrays, may still
+    need its own compilation.
+
+    :param dtypes: floating point types of the data that will be used, float32 and/or float64
+    :param sparse: whether to also compile the kernels used with scipy.sparse input
+    """
+    random_state = np.random.RandomState(0)
+    x = random_state.rand(200, 3)
+    # A categorical feature, and missing values in the numerical ones
+    x[:, 2] = random_state.randint(0, 4, x.shape[0])
+    x[random_state.rand(x.shape[0]) < 0.1, 0] = np.nan
+    y = np.vstack([x[:, 1], x[:, 1] > 0.5]).T
+
+    for dtype in dtypes:
+        for params in ({'split_values': 'random'}, {'split_values': 'best'}, {'splitter': 'hist'}):
+            forest = MixedRandomForest(n_estimators=1,
+                                       min_samples_leaf=20,
+                                       classification_targets=[1],
+                                       categorical_features=[2],
+                                       dtype=dtype,
+                                       **params)
+            forest.fit(x, y)
+            forest.predict(x)
+            if sparse and params.get('splitter') != 'hist':
+                import scipy.sparse
+                forest.fit(scipy.sparse.csc_matrix(x), y)
+                forest.predict(scipy.sparse.csr_matrix(x))
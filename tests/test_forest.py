@@ -0,0 +1,620 @@
+import pickle
+import subprocess
+import sys
+import tracemalloc
+
+import numpy as np
+import pytest
+import scipy.sparse
+from sklearn.datasets import load_breast_cancer
+
+from morfist import MixedRandomForest
+from morfist.algo.impurity import ImpurityEngine
+from morfist.core.MixedRandomTree import MixedRandomTree
+from morfist.core.MixedSplitter import MixedSplitter, get_gain
+
+# Configuration
+# Number of tress of the random forest
+n_trees = 6
+# Original data
+x_classification, y_classification = load_breast_cancer(return_X_y=True)
+# Mixed data, the first target is numerical and the second one categorical
+x_mix, y_mix = x_classification, np.vstack([x_classification[:, 0], y_classification]).T
+
+
+# The forest must be the same no matter how many workers train it
+def test_n_jobs_random_state():
+    sequential_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        random_state=0
+    )
+    sequential_rf.fit(x_mix, y_mix)
+
+    parallel_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        n_jobs=2,
+        random_state=0
+    )
+    parallel_rf.fit(x_mix, y_mix)
+
+    assert np.array_equal(sequential_rf.predict(x_mix), parallel_rf.predict(x_mix))
+
+
+# Fitting in parallel after predicting must not hang the interpreter at exit
+def test_n_jobs_after_predict():
+    code = '\n'.join(['import numpy as np',
+                      'from morfist import MixedRandomForest',
+                      "if __name__ == '__main__':",
+                      '    x = np.random.RandomState(0).rand(200, 4)',
+                      '    y = x[:, 0]',
+                      '    forest = MixedRandomForest(n_estimators=2, random_state=0)',
+                      '    forest.fit(x, y)',
+                      '    forest.predict(x)',
+                      '    MixedRandomForest(n_estimators=2, n_jobs=2, random_state=0).fit(x, y)'])
+    subprocess.run([sys.executable, '-c', code], timeout=120, check=True)
+
+
+# Test the histogram splitter with a mixed task
+def test_hist_splitter():
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        splitter='hist',
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_mix)
+    prediction = mix_rf.predict(x_mix)
+
+    assert (prediction[:, 1] == y_mix[:, 1]).mean() > 0.9
+
+
+# The counts of a right child derived from its parent and its left sibling are those of its samples
+def test_impurity_engine_counts():
+    random_state = np.random.RandomState(0)
+    weights = random_state.randint(0, 3, x_mix.shape[0])
+    engine = ImpurityEngine(y_mix, classification_targets=[1], sample_weight=weights)
+    idx = np.flatnonzero(weights)
+    left = x_mix[idx, 0] <= np.median(x_mix[idx, 0])
+    left_counts = engine.node_counts(idx[left])
+    right_counts = engine.root_counts - left_counts
+
+    assert np.array_equal(right_counts, engine.node_counts(idx[~left]))
+
+
+# The size of the trees can be bounded
+def test_tree_growth_limits():
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        max_depth=8,
+        max_leaf_nodes=16,
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_mix)
+
+    for tree in mix_rf.estimators:
+        n_leaves = np.count_nonzero(tree.features < 0)
+        assert n_leaves <= 16
+
+
+# The sorted sweep finds the same split as trying every midpoint of every feature one by one
+def test_best_split_values():
+    idx = np.random.RandomState(0).choice(x_mix.shape[0], 60, replace=False)
+    features = np.arange(5)
+    splitter = MixedSplitter(x_mix, y_mix, classification_targets=[1], split_values='best', random_state=0)
+    feature, value, gain, _ = splitter.split(idx, features=features)
+
+    engine = splitter.impurity
+    counts = engine.node_counts(idx)
+    impurity = engine.impurity(counts, idx.size)
+    candidates = []
+    for f in features:
+        values = np.unique(x_mix[idx, f])
+        for midpoint in (values[:-1] + values[1:]) / 2:
+            left = idx[x_mix[idx, f] <= midpoint]
+            right = idx[x_mix[idx, f] > midpoint]
+            if min(left.size, right.size) < splitter.min_samples_leaf:
+                continue
+            candidate_gain = get_gain(engine.impurity(engine.node_counts(left), left.size),
+                                      engine.impurity(engine.node_counts(right), right.size),
+                                      impurity,
+                                      engine.root_impurity,
+                                      left.size,
+                                      right.size,
+                                      idx.size).mean()
+            candidates.append((candidate_gain, f, midpoint))
+    best_gain, best_feature, best_value = max(candidates, key=lambda candidate: candidate[0])
+
+    assert feature == best_feature and value == best_value
+    assert np.isclose(gain, best_gain)
+
+
+# Weighting a sample is the same as repeating it
+def test_sample_weight():
+    weights = np.random.RandomState(0).randint(1, 4, x_mix.shape[0])
+    repeated_idx = np.repeat(np.arange(x_mix.shape[0]), weights)
+
+    weighted_tree = MixedRandomTree(classification_targets=[1], split_values='best', random_state=0)
+    weighted_tree.fit(x_mix, y_mix, sample_weight=weights)
+    repeated_tree = MixedRandomTree(classification_targets=[1], split_values='best', random_state=0)
+    repeated_tree.fit(x_mix[repeated_idx, :], y_mix[repeated_idx, :])
+
+    assert np.allclose(weighted_tree.predict(x_mix), repeated_tree.predict(x_mix))
+
+
+# Weights must leave at least one sample to train on
+def test_sample_weight_all_zero():
+    mix_rf = MixedRandomForest(n_estimators=n_trees, classification_targets=[1], random_state=0)
+
+    with pytest.raises(ValueError):
+        mix_rf.fit(x_mix, y_mix, sample_weight=np.zeros(x_mix.shape[0]))
+
+
+# The out-of-bag score is computed for every target during fit
+def test_oob_score():
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        oob_score=True,
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_mix)
+
+    assert mix_rf.oob_prediction_.shape == y_mix.shape
+    assert mix_rf.oob_score_[1] > 0.8
+
+
+# Growing a forest with warm_start gives the same trees as fitting all of them at once
+def test_warm_start():
+    warm_rf = MixedRandomForest(
+        n_estimators=4,
+        classification_targets=[1],
+        warm_start=True,
+        random_state=0
+    )
+    warm_rf.fit(x_mix, y_mix)
+    first_trees = list(warm_rf.estimators)
+    warm_rf.n_estimators = 8
+    warm_rf.fit(x_mix, y_mix)
+
+    full_rf = MixedRandomForest(
+        n_estimators=8,
+        classification_targets=[1],
+        random_state=0
+    )
+    full_rf.fit(x_mix, y_mix)
+
+    assert len(warm_rf.estimators) == 8 and warm_rf.estimators[:4] == first_trees
+    assert np.array_equal(warm_rf.predict(x_mix), full_rf.predict(x_mix))
+
+
+# A warm started forest can not lose trees, learn new labels or be fitted without adding trees
+def test_warm_start_checks():
+    mix_rf = MixedRandomForest(
+        n_estimators=4,
+        classification_targets=[1],
+        warm_start=True,
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_mix)
+
+    with pytest.warns(UserWarning):
+        mix_rf.fit(x_mix, y_mix)
+    assert len(mix_rf.estimators) == 4
+
+    y_new_label = y_mix.copy()
+    y_new_label[0, 1] = 2
+    mix_rf.n_estimators = 6
+    with pytest.raises(ValueError):
+        mix_rf.fit(x_mix, y_new_label)
+
+    mix_rf.n_estimators = 2
+    with pytest.raises(ValueError):
+        mix_rf.fit(x_mix, y_mix)
+
+
+# Train every tree on a subsample drawn without replacement
+def test_max_samples():
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        bootstrap=False,
+        max_samples=0.5,
+        oob_score=True,
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_mix)
+
+    assert all(m.n[0] == round(0.5 * x_mix.shape[0]) for m in mix_rf.estimators)
+    assert mix_rf.oob_score_[1] > 0.8
+
+
+# Keep the data, the trees and the predictions in float32
+def test_float32():
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        dtype=np.float32,
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_mix)
+    prediction = mix_rf.predict(x_mix)
+
+    assert prediction.dtype == np.float32
+    assert all(m.values.dtype == np.float32 and m.leaf_values.dtype == np.float32 for m in mix_rf.estimators)
+    assert (prediction[:, 1] == y_mix[:, 1]).mean() > 0.9
+
+
+# Sparse data must give the same forest and predictions as dense data
+def test_sparse_input():
+    # Mostly zeros, with negative and missing values and a categorical feature whose zeros are a category
+    random_state = np.random.RandomState(0)
+    x_sparse = x_mix - np.median(x_mix, axis=0)
+    x_sparse[random_state.rand(*x_sparse.shape) < 0.6] = 0
+    x_sparse[random_state.rand(*x_sparse.shape) < 0.05] = np.nan
+    x_sparse[:, 1] = random_state.randint(0, 4, x_sparse.shape[0]) * (x_sparse[:, 1] > 0)
+    weights = random_state.randint(0, 3, x_sparse.shape[0])
+
+    for split_values in ('random', 'best'):
+        dense_rf = MixedRandomForest(
+            n_estimators=n_trees,
+            classification_targets=[1],
+            split_values=split_values,
+            categorical_features=[1],
+            random_state=0
+        )
+        dense_rf.fit(x_sparse, y_mix, sample_weight=weights)
+
+        sparse_rf = MixedRandomForest(
+            n_estimators=n_trees,
+            classification_targets=[1],
+            split_values=split_values,
+            categorical_features=[1],
+            random_state=0
+        )
+        sparse_rf.fit(scipy.sparse.csc_matrix(x_sparse), y_mix, sample_weight=weights)
+
+        for dense_tree, sparse_tree in zip(dense_rf.estimators, sparse_rf.estimators):
+            assert np.array_equal(dense_tree.features, sparse_tree.features)
+            assert np.array_equal(dense_tree.values, sparse_tree.values, equal_nan=True)
+        assert np.array_equal(dense_rf.predict(x_sparse), sparse_rf.predict(scipy.sparse.csr_matrix(x_sparse)))
+
+
+# Categorical features are split into subsets of categories
+def test_categorical_features():
+    # The categories of the first feature are its deciles, shuffled so that their order is meaningless
+    deciles = np.searchsorted(np.percentile(x_mix[:, 0], np.arange(10, 100, 10)), x_mix[:, 0])
+    categories = np.random.RandomState(0).permutation(10)[deciles]
+    x_categorical = np.column_stack([categories, x_mix[:, 1:]])
+
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        categorical_features=[0],
+        random_state=0
+    )
+    mix_rf.fit(x_categorical, y_mix)
+    prediction = mix_rf.predict(x_categorical)
+
+    assert any(m.categories.shape[0] > 0 for m in mix_rf.estimators)
+    assert np.sqrt(np.mean((prediction[:, 0] - y_mix[:, 0]) ** 2)) < 1.5
+    assert (prediction[:, 1] == y_mix[:, 1]).mean() > 0.9
+
+
+# Bitsets of categories above 53 are not rounded when the trees are flattened
+def test_categorical_features_high_codes():
+    # 80 categories, whose bitsets use bits that a float64 can not hold exactly
+    percentiles = np.percentile(x_mix[:, 0], np.linspace(0, 100, 81)[1:-1])
+    categories = np.random.RandomState(0).permutation(80)[np.searchsorted(percentiles, x_mix[:, 0])]
+    x_categorical = np.column_stack([categories, x_mix[:, 1:]])
+
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        categorical_features=[0],
+        max_features=None,
+        random_state=0
+    )
+    mix_rf.fit(x_categorical, y_mix)
+    flat_forest = mix_rf._get_flat_forest()
+
+    for t, m in enumerate(mix_rf.estimators):
+        assert np.array_equal(flat_forest.get_tree_arrays(t)['categories'], m.categories)
+        # The leaf reached walking the tree in Python, testing the categories one bit at a time
+        leaves = np.zeros(x_categorical.shape[0], dtype=int)
+        for i, row in enumerate(x_categorical):
+            node = 0
+            while m.features[node] >= 0:
+                value = row[m.features[node]]
+                if m.features[node] == 0:
+                    bitset = m.categories[int(m.values[node])]
+                    left = int(bitset[int(value) // 64]) >> (int(value) % 64) & 1
+                else:
+                    left = value <= m.values[node]
+                node = m.left_children[node] if left else m.right_children[node]
+            leaves[i] = node
+        assert np.array_equal(mix_rf.apply(x_categorical)[:, t], leaves)
+    assert any((m.categories >= 2 ** 53).any() for m in mix_rf.estimators)
+
+
+# Missing values are sent to a child learned at every split instead of being dropped
+def test_missing_values():
+    x_missing = x_mix.copy()
+    x_missing[np.random.RandomState(0).rand(*x_missing.shape) < 0.1] = np.nan
+
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        random_state=0
+    )
+    mix_rf.fit(x_missing, y_mix)
+    prediction = mix_rf.predict(x_missing)
+
+    assert all((m._apply(x_missing) >= 0).all() for m in mix_rf.estimators)
+    assert (prediction[:, 1] == y_mix[:, 1]).mean() > 0.9
+
+
+# Importing morfist must not load numba, scipy or the legacy implementation
+def test_lazy_import():
+    code = 'import sys, morfist; print(any(m in sys.modules for m in ("numba", "scipy", "morfist.legacy.core")))'
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+
+    assert output.strip() == 'False'
+
+
+# Train the forest online, one batch at a time
+def test_partial_fit():
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        grace_period=50,
+        random_state=0
+    )
+    for _ in range(5):
+        for batch in np.array_split(np.arange(x_mix.shape[0]), 10):
+            mix_rf.partial_fit(x_mix[batch, :], y_mix[batch, :])
+    prediction = mix_rf.predict(x_mix)
+
+    assert all(len(tree.features) > 1 for tree in mix_rf.estimators)
+    assert (prediction[:, 1] == y_mix[:, 1]).mean() > 0.8
+
+
+# The samples kept by a leaf are bounded by grace_period, not by the size of the batch
+def test_partial_fit_leaf_memory():
+    tree = MixedRandomTree(classification_targets=[1], grace_period=50, random_state=0)
+    tree.partial_fit(x_mix, y_mix)
+
+    for leaf in tree._stream['leaves'].values():
+        assert leaf.x.shape[0] <= 50 and leaf.x.base is None
+        assert leaf.y.base is None and leaf.weights.base is None
+
+
+# Every tree learns from a first batch that is too small for all of them to draw a sample
+def test_partial_fit_small_batch():
+    mix_rf = MixedRandomForest(
+        n_estimators=10,
+        classification_targets=[1],
+        random_state=0
+    )
+    mix_rf.partial_fit(np.ones((1, 3)), [[5, 2]])
+
+    assert all(m.n[0] > 0 for m in mix_rf.estimators)
+    assert np.array_equal(mix_rf.predict(np.ones((1, 3))), [[5, 2]])
+
+
+# The flattened forest used for prediction must agree with every tree, and be rebuilt after more training
+def test_flat_forest():
+    def predict_trees(x):
+        flat_forest = mix_rf._get_flat_forest()
+        leaves = flat_forest.apply(x)
+        leaf_rows = flat_forest.leaf_offsets[:-1] + flat_forest.leaf_ids[leaves]
+        return flat_forest.leaf_values[leaf_rows].transpose((0, 2, 1))
+
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_mix)
+    tree_prediction = np.stack([m.predict(x_mix) for m in mix_rf.estimators], axis=2)
+
+    assert np.array_equal(predict_trees(x_mix), tree_prediction)
+    assert np.array_equal(predict_trees(scipy.sparse.csr_matrix(x_mix)), tree_prediction)
+
+    mix_rf.partial_fit(x_mix, y_mix)
+    tree_prediction = np.stack([m.predict(x_mix) for m in mix_rf.estimators], axis=2)
+
+    assert np.array_equal(predict_trees(x_mix), tree_prediction)
+
+
+# The class probabilities are the fraction of trees voting for each class
+def test_predict_proba():
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_mix)
+    proba = mix_rf.predict_proba(x_mix)
+    tree_prediction = np.stack([m.predict(x_mix)[:, 1] for m in mix_rf.estimators], axis=1)
+
+    assert len(proba) == 1
+    assert proba[0].shape == (x_mix.shape[0], 2)
+    assert np.allclose(proba[0][:, 1], tree_prediction.mean(axis=1))
+    assert np.array_equal(np.argmax(proba[0], axis=1), mix_rf.predict(x_mix)[:, 1])
+
+
+# predict_proba has one column per label when the labels do not start at 0
+def test_predict_proba_labels():
+    y_shifted = y_mix.copy()
+    y_shifted[:, 1] += 1
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_shifted)
+    proba = mix_rf.predict_proba(x_mix)
+    tree_prediction = np.stack([m.predict(x_mix)[:, 1] for m in mix_rf.estimators], axis=1)
+
+    assert proba[0].shape == (x_mix.shape[0], 2)
+    assert np.allclose(proba[0][:, 1], (tree_prediction == 2).mean(axis=1))
+    assert np.array_equal(np.argmax(proba[0], axis=1) + 1, mix_rf.predict(x_mix)[:, 1])
+
+
+# The standard deviation of the trees is computed in the same pass as the prediction
+def test_return_std():
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_mix)
+    prediction, std = mix_rf.predict(x_mix, return_std=True)
+    tree_prediction = np.stack([m.predict(x_mix)[:, 0] for m in mix_rf.estimators], axis=1)
+
+    assert np.array_equal(prediction, mix_rf.predict(x_mix))
+    assert np.allclose(prediction[:, 0], tree_prediction.mean(axis=1))
+    assert np.allclose(std[:, 0], tree_prediction.std(axis=1))
+    assert np.isnan(std[:, 1]).all()
+
+
+# The standard deviation does not lose precision when the values of the target are far from 0
+def test_return_std_offset():
+    y_offset = y_mix.copy()
+    y_offset[:, 0] += 1e9
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_offset)
+    _, std = mix_rf.predict(x_mix, return_std=True)
+    tree_prediction = np.stack([m.predict(x_mix)[:, 0] for m in mix_rf.estimators], axis=1)
+
+    assert np.allclose(std[:, 0], tree_prediction.std(axis=1), atol=1e-3)
+
+
+# Once the forest is flattened, predicting an instance does not copy the leaves of the trees
+def test_predict_memory():
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        min_samples_leaf=1,
+        classification_targets=[1],
+        random_state=0
+    )
+    # Noisy targets give about one leaf per training sample
+    random_state = np.random.RandomState(0)
+    x = random_state.rand(5000, 4)
+    y = np.column_stack([random_state.rand(5000), random_state.randint(0, 3, 5000)])
+    mix_rf.fit(x, y)
+    mix_rf.predict(x[:1])
+    mix_rf.predict_proba(x[:1])
+    leaf_values = mix_rf._get_flat_forest().leaf_values
+
+    tracemalloc.start()
+    mix_rf.predict(x[:1], return_std=True)
+    mix_rf.predict_proba(x[:1])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert peak < leaf_values.nbytes / 10
+
+
+# Predicting a .npy file or a list of blocks one chunk at a time gives the same result as predict
+def test_predict_chunks(tmp_path):
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_mix)
+    prediction = mix_rf.predict(x_mix)
+
+    np.save(tmp_path / 'x.npy', x_mix)
+    out = np.lib.format.open_memmap(tmp_path / 'prediction.npy', mode='w+', shape=prediction.shape)
+    mix_rf.predict_chunks(str(tmp_path / 'x.npy'), chunk_size=100, out=out)
+
+    assert np.array_equal(np.load(tmp_path / 'prediction.npy'), prediction)
+    assert np.array_equal(mix_rf.predict_chunks(tmp_path / 'x.npy', chunk_size=100), prediction)
+    assert np.array_equal(mix_rf.predict_chunks(np.array_split(x_mix, 7)), prediction)
+    assert len(list(mix_rf.iter_predict(x_mix, chunk_size=100))) == int(np.ceil(x_mix.shape[0] / 100))
+
+
+# The leaves and paths of every instance agree with the nodes of the trees
+def test_apply_decision_path():
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_mix)
+    leaves = mix_rf.apply(x_mix)
+    indicator, n_nodes_ptr = mix_rf.decision_path(x_mix)
+
+    assert leaves.dtype == np.int32 and leaves.shape == (x_mix.shape[0], n_trees)
+    for t, m in enumerate(mix_rf.estimators):
+        assert np.array_equal(m.leaf_values[m.leaf_ids[leaves[:, t]]], m.predict(x_mix))
+        tree_indicator = indicator[:, n_nodes_ptr[t]:n_nodes_ptr[t + 1]]
+        assert (tree_indicator[:, 0].toarray() == 1).all()
+        assert (tree_indicator[np.arange(x_mix.shape[0]), leaves[:, t]] == 1).all()
+        # Following the visited child from the root ends at the leaf, visiting no other node
+        path = tree_indicator[0].toarray()[0]
+        node, n_visited = 0, 1
+        while m.features[node] >= 0:
+            node = m.left_children[node] if path[m.left_children[node]] else m.right_children[node]
+            n_visited += 1
+        assert node == leaves[0, t] and path.sum() == n_visited
+
+
+# A saved forest is loaded, memory-mapped or not, with the same predictions
+def test_save_load(tmp_path):
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_mix)
+    mix_rf.save(tmp_path / 'forest.morfist')
+
+    for mmap in (True, False):
+        loaded_rf = MixedRandomForest.load(tmp_path / 'forest.morfist', mmap=mmap)
+
+        assert isinstance(loaded_rf.estimators[0].features, np.memmap) == mmap
+        assert np.array_equal(loaded_rf.predict(x_mix), mix_rf.predict(x_mix))
+        assert np.array_equal(loaded_rf.apply(x_mix), mix_rf.apply(x_mix))
+
+
+# The flattened forest is not pickled, it is rebuilt after unpickling
+def test_pickle():
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[1],
+        random_state=0
+    )
+    mix_rf.fit(x_mix, y_mix)
+    size = len(pickle.dumps(mix_rf))
+    prediction = mix_rf.predict(x_mix)
+
+    assert len(pickle.dumps(mix_rf)) == size
+    assert np.array_equal(pickle.loads(pickle.dumps(mix_rf)).predict(x_mix), prediction)
+
+
+# Compaction removes the splits that do not change any prediction
+def test_compact():
+    mix_rf = MixedRandomForest(
+        n_estimators=n_trees,
+        classification_targets=[0],
+        random_state=0
+    )
+    # Leaves of a classification target often predict the same class as their sibling
+    mix_rf.fit(x_mix, y_mix[:, [1]])
+    prediction = mix_rf.predict(x_mix)
+    report = mix_rf.compact()
+
+    assert report['n_nodes_after'] < report['n_nodes_before']
+    assert report['mean_depth_after'] <= report['mean_depth_before']
+    assert report['n_nodes_after'] == sum(tree.features.size for tree in mix_rf.estimators)
+    assert np.array_equal(mix_rf.predict(x_mix), prediction)